@@ -0,0 +1,162 @@
+import sys
+import time
+
+from aiohttp import web
+
+from config import relay_config
+import db_utils
+import matrix_utils
+import meshtastic_utils
+import rate_limit_utils
+from log_utils import get_logger
+
+admin_logger = get_logger("Admin")
+
+admin_config = relay_config["admin"]
+admin_runner = None
+
+def cache_stats(cache):
+    lookups = cache.hits + cache.misses
+    return {
+        "size": len(cache),
+        "maxsize": cache.maxsize,
+        "hits": cache.hits,
+        "misses": cache.misses,
+        "hit_rate": round(cache.hits / lookups, 3) if lookups else None,
+    }
+
+def get_routes():
+    routes = []
+    for room in relay_config["matrix_rooms"]:
+        room_id = matrix_utils.get_room_id(room["id"])
+        routes.append(
+            {
+                "room": room["id"],
+                "room_id": room_id,
+                "meshtastic_channel": room["meshtastic_channel"],
+                "room_paused": room_id in matrix_utils.paused_rooms,
+                "channel_paused": room["meshtastic_channel"] in meshtastic_utils.paused_channels,
+            }
+        )
+    return routes
+
+async def handle_status(request):
+    matrix_client = matrix_utils.matrix_client
+    last_sync = matrix_utils.last_sync_time
+    return web.json_response(
+        {
+            "meshtastic": {
+                "connected": meshtastic_utils.meshtastic_interface is not None,
+                "reconnecting": meshtastic_utils.reconnecting,
+                "connection_type": relay_config["meshtastic"]["connection_type"],
+            },
+            "matrix": {
+                "connected": matrix_client is not None,
+                "user_id": matrix_client.user_id if matrix_client else None,
+                "last_sync_age": round(time.time() - last_sync, 1) if last_sync else None,
+                "sync_lag": round(matrix_utils.sync_lag, 3) if matrix_utils.sync_lag is not None else None,
+                "rooms_joined": len(matrix_client.rooms) if matrix_client else 0,
+            },
+            "queues": {
+                "meshtastic_inbound": len(meshtastic_utils.pending_relays),
+                "matrix_outbound": len(matrix_utils.pending_relays),
+                "rate_limited_delayed": sum(matrix_utils.delayed_counts.values()),
+                "awaiting_radio_ack": len(meshtastic_utils.pending_acks),
+            },
+            "caches": {
+                "message_map_by_meshtastic_id": cache_stats(db_utils._message_map_by_meshtastic_id),
+                "message_map_by_event_id": cache_stats(db_utils._message_map_by_event_id),
+                "displaynames": cache_stats(matrix_utils.displayname_cache),
+                "rate_limit_senders": cache_stats(rate_limit_utils.sender_windows),
+            },
+            "paused": {
+                "rooms": sorted(matrix_utils.paused_rooms),
+                "channels": sorted(meshtastic_utils.paused_channels),
+            },
+        }
+    )
+
+async def handle_routes(request):
+    return web.json_response(get_routes())
+
+async def handle_reconnect(request):
+    if meshtastic_utils.reconnecting:
+        return web.json_response({"result": "reconnect already in progress"}, status=409)
+    admin_logger.info("Radio reconnect requested via admin API")
+    meshtastic_utils.on_lost_meshtastic_connection()
+    return web.json_response({"result": "reconnecting"})
+
+async def handle_flush(request):
+    flushed = meshtastic_utils.flush_pending_relays() + matrix_utils.flush_pending_relays()
+    admin_logger.info(f"Flushed {flushed} queued messages via admin API")
+    return web.json_response({"flushed": flushed})
+
+def parse_target(request):
+    room = request.query.get("room")
+    channel = request.query.get("channel")
+    if room:
+        return "room", matrix_utils.get_room_id(room)
+    if channel is not None:
+        try:
+            return "channel", int(channel)
+        except ValueError:
+            raise web.HTTPBadRequest(text="channel must be an integer")
+    raise web.HTTPBadRequest(text="Specify ?room=<id or alias> or ?channel=<index>")
+
+async def handle_pause(request):
+    kind, target = parse_target(request)
+    if kind == "room":
+        matrix_utils.paused_rooms.add(target)
+    else:
+        meshtastic_utils.paused_channels.add(target)
+    admin_logger.info(f"Paused {kind} {target} via admin API")
+    return web.json_response({"paused": {kind: target}})
+
+async def handle_resume(request):
+    kind, target = parse_target(request)
+    if kind == "room":
+        matrix_utils.paused_rooms.discard(target)
+    else:
+        meshtastic_utils.paused_channels.discard(target)
+    admin_logger.info(f"Resumed {kind} {target} via admin API")
+    return web.json_response({"resumed": {kind: target}})
+
+def create_admin_app():
+    app = web.Application()
+    app.router.add_get("/status", handle_status)
+    app.router.add_get("/routes", handle_routes)
+    app.router.add_post("/reconnect", handle_reconnect)
+    app.router.add_post("/flush", handle_flush)
+    app.router.add_post("/pause", handle_pause)
+    app.router.add_post("/resume", handle_resume)
+    return app
+
+async def start_admin_api():
+    """
+    Serve the control API on a Unix socket, or on localhost when no socket is configured.
+    """
+    global admin_runner
+    if not admin_config["enabled"]:
+        return None
+
+    admin_runner = web.AppRunner(create_admin_app(), access_log=None)
+    await admin_runner.setup()
+
+    unix_socket = admin_config.get("unix_socket")
+    if unix_socket and sys.platform != "win32":
+        site = web.UnixSite(admin_runner, unix_socket)
+        location = unix_socket
+    else:
+        host = admin_config["host"]
+        port = admin_config["port"]
+        site = web.TCPSite(admin_runner, host, port)
+        location = f"http://{host}:{port}"
+    await site.start()
+    admin_logger.info(f"Admin API listening on {location}")
+    return admin_runner
+
+async def stop_admin_api():
+    global admin_runner
+    if admin_runner:
+        await admin_runner.cleanup()
+        admin_runner = None
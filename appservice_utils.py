@@ -0,0 +1,199 @@
+import asyncio
+import itertools
+import time
+from urllib.parse import quote
+
+import aiohttp
+from nio import MatrixRoom, RoomMessageNotice, RoomMessageText, UnknownEvent
+from nio.events.room_events import Event
+
+from cache_utils import LRUCache
+from config import relay_config
+from log_utils import get_logger
+import matrix_utils
+
+appservice_logger = get_logger("Appservice")
+
+appservice_config = relay_config["appservice"]
+appservice_enabled = appservice_config["enabled"]
+user_prefix = appservice_config["user_prefix"]
+
+transaction_queue = None  # asyncio.Queue of event batches, created in start_appservice()
+seen_transactions = LRUCache(256)
+ensured_memberships = set()  # (user_id, room_id) pairs known to be joined
+virtual_displaynames = {}
+encrypted_rooms = set()  # Rooms seen to have m.room.encryption, from startup state and pushed events
+appservice_runner = None
+web = None  # aiohttp.web, imported by start_appservice() so bridges not using appservice mode don't pay for it
+homeserver_session = None
+_txn_ids = itertools.count()
+
+def is_virtual_user(user_id):
+    return user_id.startswith(f"@{user_prefix}")
+
+def virtual_user_id(meshtastic_id):
+    server_name = matrix_utils.matrix_client.user_id.split(":", 1)[1]
+    localpart = f"{user_prefix}{meshtastic_id.lstrip('!').lower()}"
+    return f"@{localpart}:{server_name}"
+
+async def homeserver_request(method, path, user_id=None, json=None):
+    """
+    Call the client-server API with the appservice token, optionally masquerading as a virtual user.
+    """
+    params = {"user_id": user_id} if user_id else None
+    url = relay_config["matrix"]["homeserver"].rstrip("/") + path
+    headers = {"Authorization": f"Bearer {appservice_config['as_token']}"}
+    async with homeserver_session.request(method, url, params=params, json=json, headers=headers) as response:
+        body = await response.json(content_type=None)
+        return response.status, body or {}
+
+async def ensure_virtual_user(user_id, displayname, room_id):
+    """
+    Register the virtual user, keep its display name current and make sure it is in the room.
+    Every step is cached, so a known sender costs nothing extra.
+    """
+    if user_id not in virtual_displaynames:
+        localpart = user_id.split(":", 1)[0][1:]
+        status, body = await homeserver_request(
+            "POST",
+            "/_matrix/client/v3/register",
+            json={"type": "m.login.application_service", "username": localpart},
+        )
+        if status != 200 and body.get("errcode") != "M_USER_IN_USE":
+            raise RuntimeError(f"Could not register {user_id}: {body.get('error', status)}")
+        virtual_displaynames[user_id] = None
+
+    if virtual_displaynames[user_id] != displayname:
+        await homeserver_request(
+            "PUT",
+            f"/_matrix/client/v3/profile/{quote(user_id)}/displayname",
+            user_id=user_id,
+            json={"displayname": displayname},
+        )
+        virtual_displaynames[user_id] = displayname
+
+    if (user_id, room_id) not in ensured_memberships:
+        status, body = await homeserver_request("POST", f"/_matrix/client/v3/join/{quote(room_id)}", user_id=user_id)
+        if status != 200:
+            # Private rooms need an invite from the bot first
+            await matrix_utils.matrix_client.room_invite(room_id, user_id)
+            status, body = await homeserver_request("POST", f"/_matrix/client/v3/join/{quote(room_id)}", user_id=user_id)
+            if status != 200:
+                raise RuntimeError(f"Could not join {user_id} to {room_id}: {body.get('error', status)}")
+        ensured_memberships.add((user_id, room_id))
+
+async def send_as_virtual_user(room_id, meshtastic_id, displayname, message_type, content):
+    """
+    Send an event as the virtual user for a Meshtastic node and return its event ID.
+    """
+    user_id = virtual_user_id(meshtastic_id)
+    await ensure_virtual_user(user_id, displayname, room_id)
+    txn_id = f"m2m{int(time.time() * 1000)}.{next(_txn_ids)}"
+    status, body = await homeserver_request(
+        "PUT",
+        f"/_matrix/client/v3/rooms/{quote(room_id)}/send/{message_type}/{txn_id}",
+        user_id=user_id,
+        json=content,
+    )
+    if status != 200:
+        raise RuntimeError(f"Failed to send as {user_id}: {body.get('error', status)}")
+    return body.get("event_id")
+
+def check_token(request):
+    auth = request.headers.get("Authorization", "")
+    token = auth[len("Bearer "):] if auth.startswith("Bearer ") else request.query.get("access_token")
+    if token != appservice_config["hs_token"]:
+        raise web.HTTPForbidden(text='{"errcode": "M_FORBIDDEN"}', content_type="application/json")
+
+async def handle_transaction(request):
+    check_token(request)
+    txn_id = request.match_info["txn_id"]
+    if txn_id in seen_transactions:
+        return web.json_response({})
+    body = await request.json()
+    events = body.get("events", [])
+    if events:
+        await transaction_queue.put(events)
+    seen_transactions.set(txn_id, True)
+    return web.json_response({})
+
+async def handle_query(request):
+    check_token(request)
+    return web.json_response({"errcode": "M_NOT_FOUND"}, status=404)
+
+async def process_event(event_dict):
+    room_id = event_dict.get("room_id")
+    sender = event_dict.get("sender", "")
+    if not room_id or is_virtual_user(sender):
+        return
+
+    event_type = event_dict.get("type")
+    if event_type == "m.room.encryption" and event_dict.get("state_key") == "":
+        # There is no sync in this mode, so the client's room state never sees this
+        if room_id not in encrypted_rooms:
+            appservice_logger.info(f"Room {room_id} is now encrypted; messages there will be sent by the bot user")
+        encrypted_rooms.add(room_id)
+        return
+    if event_type == "m.room.encrypted":
+        appservice_logger.warning(
+            f"Ignoring encrypted event {event_dict.get('event_id')} in {room_id}: appservice mode can't decrypt"
+        )
+        return
+
+    if event_type == "m.room.member":
+        displayname = (event_dict.get("content") or {}).get("displayname")
+        if displayname:
+            matrix_utils.displayname_cache.set(event_dict.get("state_key"), displayname)
+        return
+
+    event = Event.parse_event(event_dict)
+    room = MatrixRoom(room_id, matrix_utils.matrix_client.user_id)
+    if isinstance(event, (RoomMessageText, RoomMessageNotice)):
+        await matrix_utils.on_room_message(room, event)
+    elif isinstance(event, UnknownEvent):
+        await matrix_utils.on_room_reaction(room, event)
+
+async def run_transaction_worker():
+    """
+    Work through pushed transactions in arrival order, one batch at a time.
+    """
+    while True:
+        events = await transaction_queue.get()
+        for event_dict in events:
+            try:
+                await process_event(event_dict)
+            except Exception as e:
+                appservice_logger.error(f"Error processing event {event_dict.get('event_id')}: {e}")
+        transaction_queue.task_done()
+
+async def start_appservice():
+    global appservice_runner, homeserver_session, transaction_queue, web
+    from aiohttp import web
+
+    transaction_queue = asyncio.Queue()
+    # Seed from the state loaded at connect; later changes arrive as pushed state events
+    encrypted_rooms.update(room_id for room_id, room in matrix_utils.matrix_client.rooms.items() if room.encrypted)
+    homeserver_session = aiohttp.ClientSession()
+
+    app = web.Application()
+    for prefix in ("/_matrix/app/v1", ""):
+        app.router.add_put(prefix + "/transactions/{txn_id}", handle_transaction)
+        app.router.add_get(prefix + "/users/{user_id}", handle_query)
+        app.router.add_get(prefix + "/rooms/{alias}", handle_query)
+
+    appservice_runner = web.AppRunner(app, access_log=None)
+    await appservice_runner.setup()
+    host = appservice_config["host"]
+    port = appservice_config["port"]
+    await web.TCPSite(appservice_runner, host, port).start()
+    asyncio.create_task(run_transaction_worker())
+    appservice_logger.info(f"Appservice listening on http://{host}:{port}")
+
+async def stop_appservice():
+    global appservice_runner, homeserver_session
+    if appservice_runner:
+        await appservice_runner.cleanup()
+        appservice_runner = None
+    if homeserver_session:
+        await homeserver_session.close()
+        homeserver_session = None
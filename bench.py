@@ -0,0 +1,122 @@
+"""
+Micro-benchmarks for the relay's hot paths, plus startup cost against a budget.
+Correctness lives in the tests (python -m pytest); this only times things.
+
+    python bench.py
+"""
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from text_utils import MAX_MESSAGE_BYTES, build_message
+
+PREFIX = "Alice[M]: "
+
+# Import time (ms) and resident memory over a bare interpreter (MiB) each startup step may cost.
+# Sized for a Raspberry Pi 3; a desktop should come in well under.
+STARTUP_BUDGETS = {
+    "main.py --check-config": ("import main, config_schema; config_schema.check_config_file('config.yaml')", 150, 6),
+    "config": ("import config; config.relay_settings", 200, 8),
+    "meshtastic_utils": ("import meshtastic_utils", 300, 12),
+    "matrix_utils": ("import matrix_utils", 1500, 45),
+    "relay": ("import relay", 1800, 55),
+}
+
+STARTUP_SNIPPET = """
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+try:
+    import resource
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    rss = rss / 1024 if sys.platform != "darwin" else rss / 1024 / 1024  # KiB on Linux, bytes on macOS
+except ImportError:
+    rss = 0.0
+print(elapsed * 1000, rss)
+"""
+
+def naive_truncate(text, max_bytes=MAX_MESSAGE_BYTES):
+    """
+    The encode-everything approach the relay used before text_utils.
+    """
+    return text.encode("utf-8")[:max_bytes].decode("utf-8", "ignore")
+
+def sample_inputs():
+    random.seed(0)
+    emoji = ["😀", "👍🏽", "🇳🇿", "👩‍💻", "é", "中", "a", " "]
+    return {
+        "short ascii": "See you at the trailhead at 9",
+        "4 KiB ascii": "lorem ipsum dolor sit amet " * 150,
+        "64 KiB ascii": "lorem ipsum dolor sit amet " * 2400,
+        "4 KiB emoji": "".join(random.choice(emoji) for _ in range(1200)),
+        "64 KiB emoji": "".join(random.choice(emoji) for _ in range(19000)),
+    }
+
+def bench(label, func, number=2000):
+    seconds = min(timeit.repeat(func, number=number, repeat=5))
+    print(f"  {label:<40} {seconds / number * 1e6:10.2f} us")
+
+def bench_truncation():
+    inputs = sample_inputs()
+    print("Truncation to a radio packet:")
+    for name, text in inputs.items():
+        bench(f"{name} naive", lambda: PREFIX + naive_truncate(text, MAX_MESSAGE_BYTES - len(PREFIX)))
+        bench(f"{name} build_message", lambda: build_message(PREFIX, text))
+        bench(f"{name} build_message graphemes", lambda: build_message(PREFIX, text, graphemes=True))
+
+def measure_startup(statement, workdir, repeat=5):
+    """
+    Run a statement in fresh interpreters and return (best ms, peak RSS MiB), or an error string.
+    """
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    times, peaks = [], []
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", STARTUP_SNIPPET.format(statement=statement)],
+            cwd=workdir, env=env, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            lines = result.stderr.strip().splitlines()
+            return lines[-1] if lines else f"exit code {result.returncode}"
+        elapsed, rss = map(float, result.stdout.split())
+        times.append(elapsed)
+        peaks.append(rss)
+    return min(times), max(peaks)
+
+def bench_startup():
+    """
+    Report what each startup step costs and return how many are over budget.
+    """
+    over_budget = 0
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as workdir:
+        # Run against the sample config so the numbers don't depend on the local one
+        shutil.copy(os.path.join(here, "sample_config.yaml"), os.path.join(workdir, "config.yaml"))
+        _, baseline_rss = measure_startup("pass", workdir)
+        print(f"Startup cost (bare interpreter peak RSS {baseline_rss:.1f} MiB):")
+        for label, (statement, time_budget, rss_budget) in STARTUP_BUDGETS.items():
+            result = measure_startup(statement, workdir)
+            if isinstance(result, str):
+                print(f"  {label:<40} skipped: {result}")
+                continue
+            elapsed, rss = result
+            rss -= baseline_rss
+            status = "ok"
+            if elapsed > time_budget or rss > rss_budget:
+                status = "OVER BUDGET"
+                over_budget += 1
+            print(
+                f"  {label:<40} {elapsed:8.1f} ms / {time_budget} ms"
+                f" {rss:8.1f} MiB / {rss_budget} MiB  {status}"
+            )
+    return over_budget
+
+if __name__ == "__main__":
+    bench_truncation()
+    print()
+    sys.exit(1 if bench_startup() else 0)
@@ -0,0 +1,71 @@
+import base64
+import json
+import threading
+import time
+
+from config import relay_config
+from log_utils import get_logger
+
+capture_logger = get_logger("Capture")
+
+capture_config = relay_config["capture"]
+capture_enabled = capture_config["enabled"]
+capture_lock = threading.Lock()
+capture_file = None
+
+def sanitize(value):
+    """
+    Make a Meshtastic packet JSON-safe: drop the protobuf "raw" copies and base64 any bytes.
+    """
+    if isinstance(value, dict):
+        return {key: sanitize(item) for key, item in value.items() if key != "raw"}
+    if isinstance(value, (list, tuple)):
+        return [sanitize(item) for item in value]
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    return value
+
+def restore(value):
+    """
+    Undo sanitize() for a captured packet.
+    """
+    if isinstance(value, dict):
+        if set(value) == {"__bytes__"}:
+            return base64.b64decode(value["__bytes__"])
+        return {key: restore(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [restore(item) for item in value]
+    return value
+
+def write_record(record):
+    global capture_file
+    line = json.dumps(record, separators=(",", ":"), ensure_ascii=False, default=str)
+    with capture_lock:
+        if capture_file is None:
+            path = capture_config["file"]
+            capture_file = open(path, "a", encoding="utf-8")
+            capture_logger.info(f"Capturing inbound traffic to {path}")
+        capture_file.write(line + "\n")
+        capture_file.flush()
+
+def capture_meshtastic_packet(packet):
+    if capture_enabled:
+        write_record({"t": time.time(), "source": "meshtastic", "packet": sanitize(packet)})
+
+def capture_matrix_event(room_id, event_source):
+    if capture_enabled:
+        write_record({"t": time.time(), "source": "matrix", "room_id": room_id, "event": event_source})
+
+def read_capture(path):
+    """
+    Yield captured records in file order.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if record["source"] == "meshtastic":
+                record["packet"] = restore(record["packet"])
+            yield record
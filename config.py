@@ -1,6 +1,33 @@
 import yaml
-from yaml.loader import SafeLoader
 
-# Load configuration
-with open("config.yaml", "r") as f:
-    relay_config = yaml.load(f, Loader=SafeLoader)
+from config_schema import apply_worker_overlay, build_settings, normalize_config
+
+CONFIG_PATH = "config.yaml"
+worker_id = None  # Set by main.py --worker-id before the config is first read
+
+# The C loader is several times faster when PyYAML was built against libyaml
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+def load_config(path=CONFIG_PATH):
+    """
+    Read and normalize a config file, applying this shard worker's overrides.
+    """
+    with open(path, "r") as f:
+        config = yaml.load(f, Loader=SafeLoader) or {}
+    if worker_id:
+        config = apply_worker_overlay(config, worker_id)
+        config["sharding"] = dict(config.get("sharding") or {}, worker_id=worker_id)
+    else:
+        sharding = config.get("sharding") or {}
+        config = apply_worker_overlay(config, sharding.get("worker_id"))
+    return normalize_config(config)
+
+def __getattr__(name):
+    # Load configuration the first time something asks for it, not when config is imported
+    global relay_config, relay_settings
+    if name not in ("relay_config", "relay_settings"):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    relay_config = load_config()
+    # Precomputed lookups for the per-message paths
+    relay_settings = build_settings(relay_config)
+    return globals()[name]
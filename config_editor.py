@@ -7,23 +7,15 @@ from tkinter import messagebox
 from tkinter import ttk
 from collections import OrderedDict
 
+from config_schema import default_config, validate_config
+
 
 def create_default_config():
-    default_config = {
-        "matrix": {
-            "homeserver": "",
-            "bot_user_id": "",
-            "access_token": ""
-        },
-        "matrix_rooms": [],
-        "logging": {
-            "level": "info"
-        },
-    }
+    config = default_config()
 
     with open("config.yaml", "w") as f:
-        yaml.dump(default_config, f)
-    return default_config
+        yaml.dump(config, f)
+    return config
 
 def load_config():
     try:
@@ -32,18 +24,14 @@ def load_config():
     except FileNotFoundError:
         return create_default_config()
 
-def validate_config():
-    room_ids = [frame.room_id_var.get() for frame in matrix_rooms_frames]
-    meshtastic_channels = [int(frame.meshtastic_channel_var.get()) for frame in matrix_rooms_frames]
-
-    if len(room_ids) != len(set(room_ids)):
-        messagebox.showerror("Error", "Each Matrix room must be unique. Please check the room IDs.")
+def check_config(config):
+    """
+    Run the same checks as `main.py --check-config` and report any problems.
+    """
+    errors = validate_config(config)
+    if errors:
+        messagebox.showerror("Error", "Please fix the following:\n\n" + "\n".join(errors))
         return False
-
-    if len(meshtastic_channels) != len(set(meshtastic_channels)):
-        messagebox.showerror("Error", "Each Meshtastic channel must be unique. Please check the channel numbers.")
-        return False
-
     return True
 
 
@@ -93,7 +81,7 @@ def create_meshtastic_frame(root):
     frame.pack(fill="x", padx=5, pady=5)
 
     connection_types = ["serial", "network"]
-    connection_type_var = tk.StringVar(value=config["meshtastic"]["connection_type"])
+    connection_type_var = tk.StringVar(value=config["meshtastic"].get("connection_type", "serial"))
 
     for i, ctype in enumerate(connection_types):
         radio_button = tk.Radiobutton(frame, text=ctype, variable=connection_type_var, value=ctype)
@@ -101,25 +89,25 @@ def create_meshtastic_frame(root):
 
     serial_port_label = tk.Label(frame, text="Serial Port:")
     serial_port_label.grid(row=1, column=0, sticky="w")
-    serial_port_var = tk.StringVar(value=config["meshtastic"]["serial_port"])
+    serial_port_var = tk.StringVar(value=config["meshtastic"].get("serial_port", ""))
     serial_port_entry = tk.Entry(frame, textvariable=serial_port_var)
     serial_port_entry.grid(row=1, column=1, sticky="ew")
 
     host_label = tk.Label(frame, text="Host:")
     host_label.grid(row=2, column=0, sticky="w")
-    host_var = tk.StringVar(value=config["meshtastic"]["host"])
+    host_var = tk.StringVar(value=config["meshtastic"].get("host", ""))
     host_entry = tk.Entry(frame, textvariable=host_var)
     host_entry.grid(row=2, column=1, sticky="ew")
 
     meshnet_name_label = tk.Label(frame, text="Meshnet Name:")
     meshnet_name_label.grid(row=3, column=0, sticky="w")
-    meshnet_name_var = tk.StringVar(value=config["meshtastic"]["meshnet_name"])
+    meshnet_name_var = tk.StringVar(value=config["meshtastic"].get("meshnet_name", ""))
     meshnet_name_entry = tk.Entry(frame, textvariable=meshnet_name_var)
     meshnet_name_entry.grid(row=3, column=1, sticky="ew")
 
     broadcast_enabled_label = tk.Label(frame, text="Broadcast Enabled:")
     broadcast_enabled_label.grid(row=4, column=0, sticky="w")
-    broadcast_enabled_var = tk.BooleanVar(value=config["meshtastic"]["broadcast_enabled"])
+    broadcast_enabled_var = tk.BooleanVar(value=config["meshtastic"].get("broadcast_enabled", True))
     broadcast_enabled_checkbox = tk.Checkbutton(frame, variable=broadcast_enabled_var)
     broadcast_enabled_checkbox.grid(row=4, column=1, sticky="w")
 
@@ -136,7 +124,7 @@ def create_logging_frame(root):
     frame.pack(fill="x", padx=5, pady=5)
 
     logging_options = ["info", "warn", "error", "debug"]
-    logging_level_var = tk.StringVar(value=config["logging"]["level"])
+    logging_level_var = tk.StringVar(value=config["logging"].get("level", "info"))
 
     for i, level in enumerate(logging_options):
         radio_button = tk.Radiobutton(frame, text=level, variable=logging_level_var, value=level)
@@ -152,49 +140,53 @@ def update_entry_width(event, entry):
         entry.config(width=len(entry.get()) + 1)
 
 
-def load_config():
-    with open("config.yaml", "r") as f:
-        return yaml.safe_load(f)
-
 def save_config(config):
     with open("config.yaml", "w") as f:
         ordered_yaml_dump(config, f)
 
 def apply_changes():
-    
-    # Check if config is valid
-    if not validate_config():
-        return
+    new_config = OrderedDict()
 
     # Update matrix config
+    new_config["matrix"] = dict(config.get("matrix") or {})
+    new_config["matrix"].pop("bot_user_id", None)
     for key, var in matrix_vars.items():
-        config["matrix"][key] = var.get()
-    new_config = OrderedDict()
-    new_config["matrix"] = config["matrix"]
-    new_config["meshtastic"] = config["meshtastic"]
+        new_config["matrix"][key] = var.get()
+
+    # Update meshtastic config
+    new_config["meshtastic"] = dict(config.get("meshtastic") or {})
+    for key, var in meshtastic_vars.items():
+        new_config["meshtastic"][key] = var.get()
 
-    # Update matrix_rooms config
-    config["matrix_rooms"] = []
+    # Update matrix_rooms config, keeping per-room settings the editor doesn't show
+    existing_rooms = {room.get("id"): room for room in config.get("matrix_rooms") or []}
+    matrix_rooms = []
     for room_frame in matrix_rooms_frames:
         room_id = room_frame.room_id_var.get()
         meshtastic_channel = room_frame.meshtastic_channel_var.get()
-        config["matrix_rooms"].append({"id": room_id, "meshtastic_channel": int(meshtastic_channel)})
-    
-    # Sort matrix_rooms by meshtastic_channel and add to new_config
-    new_config["matrix_rooms"] = sorted(config["matrix_rooms"], key=lambda x: x["meshtastic_channel"])
+        try:
+            meshtastic_channel = int(meshtastic_channel)
+        except ValueError:
+            pass  # Left as text so validation reports it
+        room = dict(existing_rooms.get(room_id, {}))
+        room.update({"id": room_id, "meshtastic_channel": meshtastic_channel})
+        matrix_rooms.append(room)
 
-    new_config["logging"] = config["logging"]
+    # Sort matrix_rooms by meshtastic_channel and add to new_config
+    new_config["matrix_rooms"] = sorted(matrix_rooms, key=lambda x: x["meshtastic_channel"] if isinstance(x["meshtastic_channel"], int) else -1)
 
     # Update logging config
-    config["logging"]["level"] = logging_level_var.get()
+    new_config["logging"] = dict(config.get("logging") or {})
+    new_config["logging"]["level"] = logging_level_var.get()
 
+    # Keep sections the editor doesn't know about (rate_limit, filters, tracing, ...)
+    for key, value in config.items():
+        if key not in new_config:
+            new_config[key] = value
 
-    # Update meshtastic config
-    for key, var in meshtastic_vars.items():
-        if key == "broadcast_enabled":
-            config["meshtastic"][key] = var.get()
-        else:
-            config["meshtastic"][key] = var.get()
+    # Check if config is valid
+    if not check_config(dict(new_config)):
+        return
 
     save_config(new_config)
 
@@ -238,7 +230,11 @@ def remove_matrix_room():
         update_minsize()
 
 # GUI
-config = load_config()
+config = load_config() or {}
+config.setdefault("matrix", {})
+config.setdefault("meshtastic", {})
+config.setdefault("logging", {})
+config.setdefault("matrix_rooms", [])
 
 root = tk.Tk()
 root.title("Config Editor")
@@ -248,14 +244,16 @@ root.title("Config Editor")
 matrix_frame = tk.LabelFrame(text="Matrix", padx=5, pady=5)
 matrix_frame.pack(padx=10, pady=10, fill="x", expand="yes")
 
-matrix_keys = ["homeserver", "bot_user_id", "access_token"]
+matrix_keys = ["homeserver", "user_id", "access_token"]
 matrix_vars = {}
 
 for i, key in enumerate(matrix_keys):
     label = tk.Label(matrix_frame, text=key)
     label.grid(row=i, column=0, sticky="w")
 
-    var = tk.StringVar(value=config["matrix"][key])
+    # Older versions of the editor saved the user ID as bot_user_id
+    value = config["matrix"].get(key) or (config["matrix"].get("bot_user_id") if key == "user_id" else "")
+    var = tk.StringVar(value=value or "")
     entry = tk.Entry(matrix_frame, textvariable=var, width=49)
     entry.grid(row=i, column=1, sticky="ew")
     matrix_vars[key] = var
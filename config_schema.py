@@ -0,0 +1,422 @@
+"""
+Headless validation and normalization of config.yaml, shared by the relay
+and the config editor. Only the standard library is imported here, so
+config checks stay fast and work without nio or meshtastic installed.
+"""
+import re
+from dataclasses import dataclass, field
+
+REQUIRED = object()
+
+class Field:
+    def __init__(self, types, default=REQUIRED, choices=None, minimum=None, maximum=None, ignore_case=False):
+        self.types = types if isinstance(types, tuple) else (types,)
+        self.default = default
+        self.choices = choices
+        self.ignore_case = ignore_case  # Only for values the relay itself reads case-insensitively
+        self.minimum = minimum
+        self.maximum = maximum
+
+NUMBER = (int, float)
+
+ROOM_SCHEMA = {
+    "id": Field(str),
+    "meshtastic_channel": Field(int, minimum=0, maximum=7),
+    "rate_limit": Field(dict, None),
+    "filters": Field(dict, None),
+}
+
+RATE_LIMIT_SCHEMA = {
+    "enabled": Field(bool, False),
+    "sender_messages": Field(int, 5, minimum=1),
+    "sender_window": Field(NUMBER, 60, minimum=0),
+    "room_messages": Field(int, 20, minimum=1),
+    "room_window": Field(NUMBER, 60, minimum=0),
+    "action": Field(str, "drop", choices=("drop", "delay", "summarize")),
+    "max_delayed": Field(int, 20, minimum=0),
+    "notify_sender": Field(bool, True),
+    "tracked_senders": Field(int, 1000, minimum=1),
+}
+
+FILTERS_SCHEMA = {
+    "drop_commands": Field(list, []),
+    "deny": Field(list, []),
+    "allow": Field(list, []),
+    "strip_markdown": Field(bool, False),
+    "shorten_urls": Field(bool, False),
+    "url_placeholder": Field(str, "[link]"),
+    "replace": Field(list, []),
+}
+
+SCHEMA = {
+    "matrix": {
+        "homeserver": Field(str),
+        "access_token": Field(str),
+        "user_id": Field(str),
+        "device_id": Field(str, None),
+        "e2ee": {
+            "enabled": Field(bool, False),
+            "store_path": Field(str, "store"),
+        },
+    },
+    "meshtastic": {
+        "connection_type": Field(str, choices=("serial", "network")),
+        "serial_port": Field(str, None),
+        "host": Field(str, None),
+        "meshnet_name": Field(str),
+        "broadcast_enabled": Field(bool, True),
+        "max_message_bytes": Field(int, 227, minimum=16, maximum=237),
+        "grapheme_safe_truncation": Field(bool, False),
+        "node_refresh_interval": Field(NUMBER, 300, minimum=1),
+        "want_ack": Field(bool, False),
+        "ack_timeout": Field(NUMBER, 30, minimum=1),
+        "max_retries": Field(int, 2, minimum=0),
+        "delivery_receipts": Field(str, "reaction", choices=("reaction", "read_marker", "none")),
+        "relay_reactions": Field(bool, True),
+        "relay_edits": Field(str, "suppress", choices=("suppress", "delta")),
+    },
+    "message_map": {
+        "cache_size": Field(int, 1000, minimum=1),
+        "ttl_hours": Field(NUMBER, 72, minimum=0),
+    },
+    "filters": FILTERS_SCHEMA,
+    "rate_limit": RATE_LIMIT_SCHEMA,
+    "tracing": {
+        "enabled": Field(bool, False),
+        "sample_rate": Field(NUMBER, 0.01, minimum=0, maximum=1),
+        "file": Field(str, "traces.jsonl"),
+        "otlp_endpoint": Field(str, None),
+    },
+    "admin": {
+        "enabled": Field(bool, False),
+        "unix_socket": Field(str, None),
+        "host": Field(str, "127.0.0.1"),
+        "port": Field(int, 8765, minimum=1, maximum=65535),
+    },
+    "capture": {
+        "enabled": Field(bool, False),
+        "file": Field(str, "capture.jsonl"),
+    },
+    "sharding": {
+        "enabled": Field(bool, False),
+        "lease_db": Field(str, "shards.sqlite"),
+        "lease_seconds": Field(NUMBER, 30, minimum=3),
+        "worker_id": Field(str, None),
+        "workers": Field(dict, None),
+    },
+    "appservice": {
+        "enabled": Field(bool, False),
+        "as_token": Field(str, None),
+        "hs_token": Field(str, None),
+        "host": Field(str, "127.0.0.1"),
+        "port": Field(int, 9000, minimum=1, maximum=65535),
+        "user_prefix": Field(str, "meshtastic_"),
+    },
+    "logging": {
+        "level": Field(
+            str, "info", choices=("debug", "info", "warn", "warning", "error", "critical"), ignore_case=True
+        ),
+    },
+}
+
+@dataclass
+class RelaySettings:
+    """
+    Values the per-message paths need, computed once from the normalized config.
+    """
+
+    meshnet_name: str
+    broadcast_enabled: bool
+    max_message_bytes: int
+    grapheme_safe_truncation: bool
+    rooms: list
+    rooms_by_channel: dict = field(default_factory=dict)  # Meshtastic channel -> tuple of room configs
+    rooms_by_id: dict = field(default_factory=dict)  # Configured ID/alias and resolved ID -> room config
+
+    def add_resolved_room_id(self, room, resolved_id):
+        self.rooms_by_id[resolved_id] = room
+
+def _type_name(types):
+    return " or ".join(t.__name__ for t in types)
+
+def _check_field(path, spec, value, errors):
+    # bool is an int subclass; don't let true/false pass as a number
+    if isinstance(value, bool) and bool not in spec.types:
+        errors.append(f"{path}: must be {_type_name(spec.types)}, not {value!r}")
+        return
+    if not isinstance(value, spec.types):
+        errors.append(f"{path}: must be {_type_name(spec.types)}, not {type(value).__name__}")
+        return
+    if spec.choices and (value.lower() if spec.ignore_case else value) not in spec.choices:
+        errors.append(f"{path}: must be one of {', '.join(spec.choices)}, not {value!r}")
+    if spec.minimum is not None and value < spec.minimum:
+        errors.append(f"{path}: must be at least {spec.minimum}")
+    if spec.maximum is not None and value > spec.maximum:
+        errors.append(f"{path}: must be at most {spec.maximum}")
+
+def _check_section(path, schema, section, errors):
+    if not isinstance(section, dict):
+        errors.append(f"{path}: must be a mapping")
+        return
+    for key, spec in schema.items():
+        key_path = f"{path}.{key}" if path else key
+        value = section.get(key)
+        if isinstance(spec, dict):
+            if value is not None:
+                _check_section(key_path, spec, value, errors)
+        elif value is None:
+            if spec.default is REQUIRED:
+                errors.append(f"{key_path}: is required")
+        else:
+            _check_field(key_path, spec, value, errors)
+
+def validate_config(config):
+    """
+    Check a loaded config and return a list of readable errors; empty means valid.
+    """
+    errors = []
+    if not isinstance(config, dict):
+        return ["config: must be a mapping"]
+
+    config = _apply_aliases(dict(config))
+    for key in ("matrix", "meshtastic"):
+        if key not in config:
+            errors.append(f"{key}: section is required")
+    _check_section("", {key: spec for key, spec in SCHEMA.items() if key in config}, config, errors)
+
+    rooms = config.get("matrix_rooms")
+    if not isinstance(rooms, list) or not rooms:
+        errors.append("matrix_rooms: at least one room is required")
+        rooms = []
+    for index, room in enumerate(rooms):
+        path = f"matrix_rooms[{index}]"
+        _check_section(path, ROOM_SCHEMA, room, errors)
+        if isinstance(room, dict):
+            room_id = room.get("id")
+            if isinstance(room_id, str) and not room_id.startswith(("!", "#")):
+                errors.append(f"{path}.id: must be a room ID (!...) or alias (#...)")
+            if isinstance(room.get("rate_limit"), dict):
+                _check_section(f"{path}.rate_limit", RATE_LIMIT_SCHEMA, room["rate_limit"], errors)
+            if isinstance(room.get("filters"), dict):
+                _check_section(f"{path}.filters", FILTERS_SCHEMA, room["filters"], errors)
+                _check_filters(f"{path}.filters", room["filters"], errors)
+    if isinstance(config.get("filters"), dict):
+        _check_filters("filters", config["filters"], errors)
+
+    # Only values that passed the type checks above; anything else is already reported
+    room_ids = [room["id"] for room in rooms if isinstance(room, dict) and isinstance(room.get("id"), str)]
+    if len(room_ids) != len(set(room_ids)):
+        errors.append("matrix_rooms: each Matrix room must be unique")
+    channels = [
+        room["meshtastic_channel"] for room in rooms
+        if isinstance(room, dict) and type(room.get("meshtastic_channel")) is int
+    ]
+    if len(channels) != len(set(channels)):
+        errors.append("matrix_rooms: each Meshtastic channel must be unique")
+
+    meshtastic = config.get("meshtastic")
+    if isinstance(meshtastic, dict):
+        if meshtastic.get("connection_type") == "serial" and not meshtastic.get("serial_port"):
+            errors.append("meshtastic.serial_port: is required for serial connections")
+        if meshtastic.get("connection_type") == "network" and not meshtastic.get("host"):
+            errors.append("meshtastic.host: is required for network connections")
+
+    matrix = config.get("matrix")
+    if isinstance(matrix, dict) and isinstance(matrix.get("e2ee"), dict):
+        if matrix["e2ee"].get("enabled") and not matrix.get("device_id"):
+            errors.append("matrix.device_id: is required when matrix.e2ee.enabled is set")
+
+    appservice = config.get("appservice")
+    if isinstance(appservice, dict) and appservice.get("enabled"):
+        for key in ("as_token", "hs_token"):
+            if not appservice.get(key):
+                errors.append(f"appservice.{key}: is required when appservice.enabled is set")
+        if isinstance(matrix, dict) and isinstance(matrix.get("e2ee"), dict) and matrix["e2ee"].get("enabled"):
+            errors.append(
+                "appservice.enabled: can't be used with matrix.e2ee.enabled; without a sync loop "
+                "the bot never receives room keys"
+            )
+
+    sharding = config.get("sharding")
+    if isinstance(sharding, dict) and sharding.get("enabled"):
+        _check_sharding(config, sharding, errors)
+
+    return errors
+
+def _check_regex(path, pattern, errors):
+    if not isinstance(pattern, str):
+        errors.append(f"{path}: must be a regex string, not {type(pattern).__name__}")
+        return
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        errors.append(f"{path}: invalid regex {pattern!r}: {e}")
+
+def _check_filters(path, filters, errors):
+    # The list fields' own types were checked by _check_section; look inside them
+    for key in ("deny", "allow"):
+        if isinstance(filters.get(key), list):
+            for index, pattern in enumerate(filters[key]):
+                _check_regex(f"{path}.{key}[{index}]", pattern, errors)
+    if isinstance(filters.get("drop_commands"), list):
+        for index, prefix in enumerate(filters["drop_commands"]):
+            if not isinstance(prefix, str):
+                errors.append(f"{path}.drop_commands[{index}]: must be str, not {type(prefix).__name__}")
+    if isinstance(filters.get("replace"), list):
+        for index, replacement in enumerate(filters["replace"]):
+            item_path = f"{path}.replace[{index}]"
+            if not isinstance(replacement, dict):
+                errors.append(f"{item_path}: must be a mapping with pattern and with")
+                continue
+            if "pattern" not in replacement:
+                errors.append(f"{item_path}.pattern: is required")
+            else:
+                _check_regex(f"{item_path}.pattern", replacement["pattern"], errors)
+            if not isinstance(replacement.get("with", ""), str):
+                errors.append(f"{item_path}.with: must be str")
+
+# Sections a sharding.workers entry may override for its worker
+WORKER_SECTIONS = ("meshtastic", "admin", "appservice")
+
+def _check_sharding(config, sharding, errors):
+    matrix = config.get("matrix")
+    if isinstance(matrix, dict) and isinstance(matrix.get("e2ee"), dict) and matrix["e2ee"].get("enabled"):
+        errors.append("sharding.enabled: can't be used with matrix.e2ee.enabled; workers would share one Olm device and store")
+
+    workers = sharding.get("workers")
+    if not isinstance(workers, dict):
+        return
+    holders = {}
+    for worker_id, overlay in workers.items():
+        path = f"sharding.workers.{worker_id}"
+        if not isinstance(overlay, dict):
+            errors.append(f"{path}: must be a mapping")
+            continue
+        for key, section in overlay.items():
+            if key not in WORKER_SECTIONS:
+                errors.append(f"{path}.{key}: workers can only override {', '.join(WORKER_SECTIONS)}")
+            elif not isinstance(section, dict):
+                errors.append(f"{path}.{key}: must be a mapping")
+        for resource in worker_resources(apply_worker_overlay(config, worker_id)):
+            if resource in holders:
+                errors.append(f"{path}: uses the same {resource} as worker {holders[resource]}")
+            else:
+                holders[resource] = worker_id
+
+def apply_worker_overlay(config, worker_id):
+    """
+    Return the config as the given shard worker sees it, with its sharding.workers entry applied.
+    """
+    sharding = config.get("sharding")
+    workers = sharding.get("workers") if isinstance(sharding, dict) else None
+    overlay = workers.get(worker_id) if isinstance(workers, dict) else None
+    if not isinstance(overlay, dict):
+        return config
+    config = dict(config)
+    for key, section in overlay.items():
+        if key in WORKER_SECTIONS and isinstance(section, dict):
+            base = config.get(key)
+            config[key] = dict(base if isinstance(base, dict) else {}, **section)
+    return config
+
+def worker_resources(config):
+    """
+    What only one worker at a time can use: its radio and the sockets it listens on.
+    """
+    resources = []
+    meshtastic = config.get("meshtastic")
+    if isinstance(meshtastic, dict):
+        if meshtastic.get("connection_type") == "serial":
+            resources.append(f"serial port {meshtastic.get('serial_port')}")
+        else:
+            resources.append(f"radio at {meshtastic.get('host')}")
+    admin = config.get("admin")
+    if isinstance(admin, dict) and admin.get("enabled"):
+        if admin.get("unix_socket"):
+            resources.append(f"admin socket {admin['unix_socket']}")
+        else:
+            resources.append(f"admin port {admin.get('host', '127.0.0.1')}:{admin.get('port', 8765)}")
+    appservice = config.get("appservice")
+    if isinstance(appservice, dict) and appservice.get("enabled"):
+        resources.append(f"appservice port {appservice.get('host', '127.0.0.1')}:{appservice.get('port', 9000)}")
+    return resources
+
+def _apply_aliases(config):
+    # The config editor used to write matrix.bot_user_id
+    matrix = config.get("matrix")
+    if isinstance(matrix, dict) and "user_id" not in matrix and "bot_user_id" in matrix:
+        config["matrix"] = dict(matrix, user_id=matrix["bot_user_id"])
+    return config
+
+def _fill_defaults(schema, section):
+    for key, spec in schema.items():
+        if isinstance(spec, dict):
+            value = section.get(key)
+            if not isinstance(value, dict):
+                value = section[key] = {}
+            _fill_defaults(spec, value)
+        elif key not in section and spec.default is not REQUIRED and spec.default is not None:
+            section[key] = list(spec.default) if isinstance(spec.default, list) else spec.default
+
+def normalize_config(config):
+    """
+    Return the config with aliases resolved and every section a dict with its
+    optional settings filled in, so an empty `tracing:` means the defaults.
+    Per-room overrides are left as written.
+    """
+    config = _apply_aliases(dict(config or {}))
+    for key in SCHEMA:
+        section = config.get(key)
+        section = config[key] = dict(section) if isinstance(section, dict) else {}
+        _fill_defaults(SCHEMA[key], section)
+    config.setdefault("matrix_rooms", [])
+    return config
+
+def build_settings(config):
+    """
+    Precompute the lookups the relay's hot paths use from a normalized config.
+    """
+    meshtastic = config["meshtastic"]
+    rooms = [room for room in config["matrix_rooms"] if isinstance(room, dict)]
+    settings = RelaySettings(
+        meshnet_name=meshtastic.get("meshnet_name", ""),
+        broadcast_enabled=meshtastic["broadcast_enabled"],
+        max_message_bytes=meshtastic["max_message_bytes"],
+        grapheme_safe_truncation=meshtastic["grapheme_safe_truncation"],
+        rooms=rooms,
+    )
+    by_channel = {}
+    for room in rooms:
+        by_channel.setdefault(room.get("meshtastic_channel"), []).append(room)
+        settings.rooms_by_id[room.get("id")] = room
+    settings.rooms_by_channel = {channel: tuple(group) for channel, group in by_channel.items()}
+    return settings
+
+def default_config():
+    """
+    A skeleton config with every required setting blank and optional ones at their defaults.
+    """
+    config = {}
+    for key in ("matrix", "meshtastic", "logging"):
+        config[key] = {}
+        for name, spec in SCHEMA[key].items():
+            if isinstance(spec, Field) and spec.default is not None:
+                config[key][name] = "" if spec.default is REQUIRED else spec.default
+    config["meshtastic"]["connection_type"] = "serial"
+    config["matrix_rooms"] = []
+    return config
+
+def check_config_file(path):
+    """
+    Load and validate a config file. Returns the list of errors.
+    """
+    import yaml
+
+    try:
+        with open(path, "r") as f:
+            config = yaml.safe_load(f)
+    except OSError as e:
+        return [f"{path}: {e.strerror}"]
+    except yaml.YAMLError as e:
+        return [f"{path}: invalid YAML: {e}"]
+    return validate_config(config)
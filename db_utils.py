@@ -1,4 +1,17 @@
 import sqlite3
+import time
+
+from cache_utils import LRUCache
+from config import relay_config
+
+message_map_config = relay_config["message_map"]
+message_map_ttl = message_map_config["ttl_hours"] * 3600
+message_map_prune_every = 500
+
+# Hot entries of the message map, looked up by either side of the relay
+_message_map_by_meshtastic_id = LRUCache(message_map_config["cache_size"])
+_message_map_by_event_id = LRUCache(message_map_config["cache_size"])
+_message_map_saves = 0
 
 # Initialize SQLite database
 def initialize_database():
@@ -8,7 +21,15 @@ def initialize_database():
             "CREATE TABLE IF NOT EXISTS longnames (meshtastic_id TEXT PRIMARY KEY, longname TEXT)")
         cursor.execute(
             "CREATE TABLE IF NOT EXISTS shortnames (meshtastic_id TEXT PRIMARY KEY, shortname TEXT)")
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS message_map (matrix_event_id TEXT PRIMARY KEY, meshtastic_id INTEGER, "
+            "matrix_room_id TEXT, meshtastic_text TEXT, meshtastic_channel INTEGER, created_at REAL)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_message_map_meshtastic_id ON message_map (meshtastic_id)")
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_message_map_created_at ON message_map (created_at)")
         conn.commit()
+    prune_message_map()
 
 # Get the longname for a given Meshtastic ID
 def get_longname(meshtastic_id):
@@ -44,3 +65,119 @@ def save_shortname(meshtastic_id, shortname):
             (meshtastic_id, shortname),
         )
         conn.commit()
+
+def save_names(names):
+    """
+    Save (meshtastic_id, longname, shortname) rows in a single transaction.
+    """
+    with sqlite3.connect("meshtastic.sqlite") as conn:
+        cursor = conn.cursor()
+        cursor.executemany(
+            "INSERT OR REPLACE INTO longnames (meshtastic_id, longname) VALUES (?, ?)",
+            [(meshtastic_id, longname) for meshtastic_id, longname, _ in names],
+        )
+        cursor.executemany(
+            "INSERT OR REPLACE INTO shortnames (meshtastic_id, shortname) VALUES (?, ?)",
+            [(meshtastic_id, shortname) for meshtastic_id, _, shortname in names],
+        )
+        conn.commit()
+
+def _message_map_entry(row):
+    return {
+        "matrix_event_id": row[0],
+        "meshtastic_id": row[1],
+        "matrix_room_id": row[2],
+        "meshtastic_text": row[3],
+        "meshtastic_channel": row[4],
+        "created_at": row[5],
+    }
+
+def _fresh(entry):
+    # Cached entries expire with their rows, whether or not a prune has run since
+    return entry if entry and entry["created_at"] >= time.time() - message_map_ttl else None
+
+def save_message_map(meshtastic_id, matrix_event_id, matrix_room_id, meshtastic_text, meshtastic_channel):
+    """
+    Record that a Meshtastic packet and a Matrix event are the same message.
+    """
+    global _message_map_saves
+    created_at = time.time()
+    entry = _message_map_entry(
+        (matrix_event_id, meshtastic_id, matrix_room_id, meshtastic_text, meshtastic_channel, created_at)
+    )
+    _message_map_by_meshtastic_id.set(meshtastic_id, entry)
+    _message_map_by_event_id.set(matrix_event_id, entry)
+
+    with sqlite3.connect("meshtastic.sqlite") as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO message_map (matrix_event_id, meshtastic_id, matrix_room_id, "
+            "meshtastic_text, meshtastic_channel, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (matrix_event_id, meshtastic_id, matrix_room_id, meshtastic_text, meshtastic_channel, created_at),
+        )
+        conn.commit()
+
+    _message_map_saves += 1
+    if _message_map_saves % message_map_prune_every == 0:
+        prune_message_map()
+
+def get_message_map_by_meshtastic_id(meshtastic_id):
+    entry = _fresh(_message_map_by_meshtastic_id.get(meshtastic_id))
+    if entry:
+        return entry
+    with sqlite3.connect("meshtastic.sqlite") as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT matrix_event_id, meshtastic_id, matrix_room_id, meshtastic_text, meshtastic_channel, created_at "
+            "FROM message_map WHERE meshtastic_id=? AND created_at >= ? ORDER BY created_at DESC LIMIT 1",
+            (meshtastic_id, time.time() - message_map_ttl))
+        result = cursor.fetchone()
+    if not result:
+        return None
+    entry = _message_map_entry(result)
+    _message_map_by_meshtastic_id.set(meshtastic_id, entry)
+    return entry
+
+def get_message_map_by_event_id(matrix_event_id):
+    entry = _fresh(_message_map_by_event_id.get(matrix_event_id))
+    if entry:
+        return entry
+    with sqlite3.connect("meshtastic.sqlite") as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT matrix_event_id, meshtastic_id, matrix_room_id, meshtastic_text, meshtastic_channel, created_at "
+            "FROM message_map WHERE matrix_event_id=? AND created_at >= ?",
+            (matrix_event_id, time.time() - message_map_ttl))
+        result = cursor.fetchone()
+    if not result:
+        return None
+    entry = _message_map_entry(result)
+    _message_map_by_event_id.set(matrix_event_id, entry)
+    return entry
+
+def update_message_map_text(entry, meshtastic_text):
+    """
+    Record the text the mesh now has for a mapped message, after an edit went out.
+    """
+    entry = dict(entry, meshtastic_text=meshtastic_text)
+    _message_map_by_event_id.set(entry["matrix_event_id"], entry)
+    cached = _message_map_by_meshtastic_id.get(entry["meshtastic_id"])
+    if cached and cached["matrix_event_id"] == entry["matrix_event_id"]:
+        _message_map_by_meshtastic_id.set(entry["meshtastic_id"], entry)
+    with sqlite3.connect("meshtastic.sqlite") as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE message_map SET meshtastic_text=? WHERE matrix_event_id=?",
+            (meshtastic_text, entry["matrix_event_id"]),
+        )
+        conn.commit()
+
+def prune_message_map():
+    """
+    Drop message map rows older than the configured TTL.
+    """
+    with sqlite3.connect("meshtastic.sqlite") as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM message_map WHERE created_at < ?", (time.time() - message_map_ttl,))
+        conn.commit()
@@ -0,0 +1,86 @@
+import re
+
+from config import relay_config
+from log_utils import get_logger
+
+filter_logger = get_logger("Filters")
+
+URL_PATTERN = re.compile(r"\b(?:https?://|www\.)\S+", re.IGNORECASE)
+CODE_BLOCK_PATTERN = re.compile(r"```.*?(?:```|$)", re.DOTALL)
+INLINE_CODE_PATTERN = re.compile(r"`([^`\n]+)`")
+LINK_PATTERN = re.compile(r"!?\[([^\]]*)\]\([^)]*\)")
+# Delimiters only count with a non-word character or the string edge outside them (CommonMark flanking),
+# so snake_case_names and 2*3*4 are left alone
+EMPHASIS_PATTERN = re.compile(r"(?<![\w*_~])(\*\*|__|~~|\*|_)(?=\S)(.+?)(?<=\S)\1(?![\w*_~])")
+LINE_MARKUP_PATTERN = re.compile(r"^\s{0,3}(?:#{1,6}\s+|>\s?|[-*+]\s+)", re.MULTILINE)
+WHITESPACE_PATTERN = re.compile(r"[ \t]*\n\s*")
+
+# Room ID or alias -> compiled list of stages
+room_pipelines = {}
+
+def strip_markdown(text):
+    """
+    Reduce Markdown to the plain text a radio user would want to read.
+    """
+    text = CODE_BLOCK_PATTERN.sub("[code]", text)
+    text = INLINE_CODE_PATTERN.sub(r"\1", text)
+    text = LINK_PATTERN.sub(r"\1", text)
+    text = EMPHASIS_PATTERN.sub(r"\2", text)
+    text = LINE_MARKUP_PATTERN.sub("", text)
+    return WHITESPACE_PATTERN.sub(" / ", text.strip())
+
+def compile_pipeline(filters):
+    """
+    Turn a room's filter config into a list of stages. Each stage takes the
+    message text and returns the new text, or None to drop the message.
+    """
+    stages = []
+
+    command_prefixes = tuple(filters.get("drop_commands", []))
+    if command_prefixes:
+        stages.append(lambda text: None if text.startswith(command_prefixes) else text)
+
+    deny = [re.compile(pattern, re.IGNORECASE) for pattern in filters.get("deny", [])]
+    if deny:
+        stages.append(lambda text: None if any(p.search(text) for p in deny) else text)
+
+    allow = [re.compile(pattern, re.IGNORECASE) for pattern in filters.get("allow", [])]
+    if allow:
+        stages.append(lambda text: text if any(p.search(text) for p in allow) else None)
+
+    if filters.get("strip_markdown", False):
+        stages.append(strip_markdown)
+
+    if filters.get("shorten_urls", False):
+        placeholder = filters.get("url_placeholder", "[link]")
+        stages.append(lambda text: URL_PATTERN.sub(placeholder, text))
+
+    for replacement in filters.get("replace", []):
+        pattern = re.compile(replacement["pattern"])
+        stages.append(lambda text, pattern=pattern, repl=replacement.get("with", ""): pattern.sub(repl, text))
+
+    return stages
+
+def compile_pipelines():
+    """
+    Compile every room's pipeline up front. Room settings override the global filters section key by key.
+    """
+    room_pipelines.clear()
+    global_filters = relay_config["filters"]
+    for room in relay_config["matrix_rooms"]:
+        filters = dict(global_filters)
+        filters.update(room.get("filters") or {})
+        room_pipelines[room["id"]] = compile_pipeline(filters)
+    filter_logger.debug(f"Compiled filters for {len(room_pipelines)} rooms")
+
+def apply_filters(room_config, text):
+    """
+    Run text through the room's pipeline. Returns None if the message should not be relayed.
+    """
+    if not room_pipelines:
+        compile_pipelines()
+    for stage in room_pipelines.get(room_config["id"], ()):
+        text = stage(text)
+        if not text:
+            return None
+    return text
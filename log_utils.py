@@ -25,7 +25,7 @@ def get_logger(name: str):
     logger = logging.getLogger(name)
 
     # Get logging level from config, default to INFO
-    logging_level_str = relay_config.get("logging", {}).get("level", "INFO").upper()
+    logging_level_str = relay_config["logging"]["level"].upper()
     log_level = getattr(logging, logging_level_str, logging.INFO)
     logger.setLevel(log_level)
     logger.propagate = False
@@ -1,124 +1,140 @@
-import asyncio
+import argparse
 import signal
 import sys
+import time
+
+from config_schema import check_config_file
+
+def check_config(path):
+    """
+    Validate a config file and report the result. Returns the process exit code.
+    """
+    start = time.perf_counter()
+    errors = check_config_file(path)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if errors:
+        print(f"{path}: {len(errors)} problem{'s' if len(errors) > 1 else ''} found", file=sys.stderr)
+        for error in errors:
+            print(f"  {error}", file=sys.stderr)
+        return 1
+    print(f"{path}: OK ({elapsed_ms:.1f} ms)")
+    return 0
+
+def run_workers(count):
+    """
+    Coordinator mode: run `count` relay workers as child processes that split
+    the configured rooms between them through shard leases, restarting any
+    that exit until interrupted. Each worker takes the next entry of
+    sharding.workers, which gives it its own radio and listening ports.
+    """
+    import subprocess
+
+    import shard_utils
+    from log_utils import get_logger
+
+    logger = get_logger("M<>M Relay")
+
+    if not shard_utils.sharding_enabled:
+        logger.error("--workers requires sharding.enabled in config.yaml")
+        return 1
+
+    worker_ids = list(shard_utils.sharding_config.get("workers") or {})
+    if len(worker_ids) < count:
+        logger.error(
+            f"--workers {count} needs {count} entries in sharding.workers, each with its own radio; "
+            f"found {len(worker_ids)}"
+        )
+        return 1
+
+    if getattr(sys, "frozen", False):
+        command = [sys.executable]
+    else:
+        command = [sys.executable, sys.argv[0]]
 
-from config import relay_config
-from db_utils import initialize_database
-from log_utils import get_logger
-import meshtastic_utils  # Import the module instead of variables
-import matrix_utils  # Import the module instead of variables
-
-logger = get_logger("M<>M Relay")
-
-shutdown_event = asyncio.Event()
-
-async def main():
-    global shutdown_event
-
-    # Initialize the SQLite database
-    initialize_database()
-
-    # Set up signal handling
-    loop = asyncio.get_running_loop()
-    meshtastic_utils.meshtastic_event_loop = loop  # Set the event loop in meshtastic_utils
-    matrix_utils.matrix_event_loop = loop  # Set the event loop in matrix_utils
-
-    async def shutdown():
-        logger.info("Shutdown signal received. Closing down...")
-        meshtastic_utils.shutting_down = True
-        shutdown_event.set()
+    def spawn(index):
+        return subprocess.Popen(command + ["--worker-id", worker_ids[index]])
 
     if sys.platform != "win32":
-        for sig in (signal.SIGINT, signal.SIGTERM):
-            loop.add_signal_handler(sig, lambda: asyncio.create_task(shutdown()))
-    else:
-        pass  # On Windows, rely on KeyboardInterrupt
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
 
+    logger.info(f"Starting {count} relay workers")
+    workers = {index: spawn(index) for index in range(count)}
+    started = {index: time.monotonic() for index in range(count)}
+    restart_delay = {index: 1 for index in range(count)}
+    restart_at = {}
     try:
-        # Connect to Matrix
-        await matrix_utils.connect_matrix()
-        if matrix_utils.matrix_client is None:
-            logger.error("Failed to connect to Matrix server. Exiting.")
-            return
-
-        # Join Matrix rooms
-        await matrix_utils.join_matrix_rooms()
-
-        # Connect to Meshtastic
-        await meshtastic_utils.connect_meshtastic()
-        if meshtastic_utils.meshtastic_interface is None:
-            logger.error("Failed to connect to Meshtastic device. Exiting.")
-            return
-
-        # Start the Matrix client sync loop
-        try:
-            while not shutdown_event.is_set():
-                try:
-                    if meshtastic_utils.meshtastic_interface:
-                        # Update longnames & shortnames
-                        meshtastic_utils.update_longnames()
-                        meshtastic_utils.update_shortnames()
-                    else:
-                        meshtastic_utils.meshtastic_logger.warning("Meshtastic client is not connected.")
-
-                    matrix_utils.matrix_logger.info("Starting Matrix sync loop...")
-                    sync_task = asyncio.create_task(
-                        matrix_utils.matrix_client.sync_forever(timeout=30000)
-                    )
-                    shutdown_task = asyncio.create_task(shutdown_event.wait())
-                    done, pending = await asyncio.wait(
-                        [sync_task, shutdown_task],
-                        return_when=asyncio.FIRST_COMPLETED,
-                    )
-                    if shutdown_event.is_set():
-                        matrix_utils.matrix_logger.info("Shutdown event detected. Stopping sync loop...")
-                        sync_task.cancel()
-                        try:
-                            await sync_task
-                        except asyncio.CancelledError:
-                            pass
-                        break
-                except Exception as e:
-                    if shutdown_event.is_set():
-                        break
-                    matrix_utils.matrix_logger.error(f"Error syncing with Matrix server: {e}")
-                    await asyncio.sleep(5)  # Wait before retrying
-        except KeyboardInterrupt:
-            await shutdown()
-        finally:
-            # Cleanup
-            if matrix_utils.matrix_client:
-                matrix_utils.matrix_logger.info("Closing Matrix client...")
-                await matrix_utils.matrix_client.close()
-            else:
-                matrix_utils.matrix_logger.warning("Matrix client was not initialized.")
-
-            if meshtastic_utils.meshtastic_interface:
-                meshtastic_utils.meshtastic_logger.info("Closing Meshtastic client...")
-                try:
-                    meshtastic_utils.meshtastic_interface.close()
-                except Exception as e:
-                    meshtastic_utils.meshtastic_logger.warning(f"Error closing Meshtastic client: {e}")
-            else:
-                meshtastic_utils.meshtastic_logger.warning("Meshtastic client was not initialized.")
-
-            # Cancel the reconnect task if it exists
-            if meshtastic_utils.reconnect_task:
-                meshtastic_utils.reconnect_task.cancel()
-                meshtastic_utils.meshtastic_logger.info("Cancelled Meshtastic reconnect task.")
-
-            # Cancel any remaining tasks
-            tasks = [t for t in asyncio.all_tasks(loop) if not t.done()]
-            for task in tasks:
-                task.cancel()
-                try:
-                    await task
-                except asyncio.CancelledError:
-                    pass
-            matrix_utils.matrix_logger.info("Shutdown complete.")
-
-    except Exception as e:
-        logger.error(f"An unexpected error occurred: {e}")
+        while workers or restart_at:
+            time.sleep(1)
+            now = time.monotonic()
+            for index, process in list(workers.items()):
+                if process.poll() is None:
+                    continue
+                del workers[index]
+                if process.returncode == shard_utils.RESOURCE_CONFLICT_EXIT:
+                    # Restarting can't help while another worker holds its radio or ports
+                    logger.error(f"Worker {worker_ids[index]} can't get its radio or ports. Not restarting it.")
+                    continue
+                # Back off on workers that keep failing; reset once one stays up for a while
+                if now - started[index] > 60:
+                    restart_delay[index] = 1
+                else:
+                    restart_delay[index] = min(restart_delay[index] * 2, 60)
+                logger.warning(
+                    f"Worker {index} exited with code {process.returncode}. "
+                    f"Restarting in {restart_delay[index]}s..."
+                )
+                restart_at[index] = now + restart_delay[index]
+            for index, when in list(restart_at.items()):
+                if when <= now:
+                    del restart_at[index]
+                    workers[index] = spawn(index)
+                    started[index] = now
+        logger.error("No relay workers left to run")
+        return 1
+    except KeyboardInterrupt:
+        logger.info("Stopping relay workers...")
+    finally:
+        for process in workers.values():
+            process.terminate()
+        for process in workers.values():
+            process.wait()
+    return 0
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Meshtastic <=> Matrix Relay (Lite)")
+    parser.add_argument(
+        "--check-config",
+        nargs="?",
+        const="config.yaml",
+        metavar="PATH",
+        help="Validate a config file (default: config.yaml) and exit",
+    )
+    parser.add_argument("--workers", type=int, default=0, help="Run this many sharded relay workers")
+    parser.add_argument("--worker-id", help="Shard worker ID (overrides sharding.worker_id)")
+    args = parser.parse_args(argv)
+
+    if args.check_config:
+        return check_config(args.check_config)
+
+    # Refuse to start on a bad config instead of failing later on a missing key
+    if check_config_file("config.yaml"):
+        return check_config("config.yaml")
+
+    if args.workers > 0:
+        return run_workers(args.workers)
+
+    if args.worker_id:
+        import config
+
+        # Picks this worker's sharding.workers entry when the config is read
+        config.worker_id = args.worker_id
+
+    # asyncio, nio and the rest of the relay load only once the config has passed
+    import asyncio
+
+    import relay
+
+    return asyncio.run(relay.main()) or 0
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    sys.exit(run())
@@ -1,26 +1,55 @@
 import asyncio
+import os
+import random
 import ssl
 import time
-import re
 from typing import Union
 
 from nio import (
     AsyncClient,
     AsyncClientConfig,
     MatrixRoom,
+    MegolmEvent,
     RoomMessageText,
     RoomMessageNotice,
+    SyncError,
+    SyncResponse,
+    UnknownEvent,
 )
+from nio.crypto import ENCRYPTION_ENABLED
 from pubsub import pub
 
-from config import relay_config
+from cache_utils import LRUCache
+from capture_utils import capture_matrix_event
+from config import relay_config, relay_settings
+from db_utils import (
+    get_message_map_by_event_id,
+    get_message_map_by_meshtastic_id,
+    save_message_map,
+    update_message_map_text,
+)
+from filter_utils import apply_filters
 from log_utils import get_logger
+from rate_limit_utils import check_rate_limit, get_rate_limit_settings
+from shard_utils import owns_room
+from text_utils import build_message
+from trace_utils import start_trace, span, add_span, set_attributes, hold_trace, finish_trace
+import appservice_utils
 
 matrix_logger = get_logger("Matrix")
 
 # Use module-level variables
 matrix_client = None
 matrix_event_loop = None  # Will be set in main()
+last_sync_time = None
+sync_lag = None  # Seconds between the newest event's server timestamp and our processing of it
+paused_rooms = set()  # Resolved room IDs paused through the admin API
+pending_relays = set()  # Radio messages scheduled for sending to Matrix
+displayname_cache = LRUCache(1024)  # Matrix user ID -> display name
+delayed_counts = {}  # Room ID -> messages held back by the rate limiter
+suppressed_counts = {}  # (room ID, sender) -> messages folded into a pending summary
+rate_limit_notices = LRUCache(1000)  # Sender -> when they were last told they're rate limited
+background_tasks = set()  # Fire-and-forget work; referenced here until done so it isn't collected
 
 # Timestamp when the bot starts, used to filter out old messages
 bot_start_time = int(time.time() * 1000)
@@ -35,23 +64,44 @@ async def connect_matrix():
     matrix_server = relay_config["matrix"]["homeserver"]
     access_token = relay_config["matrix"]["access_token"]
     user_id = relay_config["matrix"]["user_id"]
+    device_id = relay_config["matrix"].get("device_id")
 
     ssl_context = ssl.create_default_context()
 
-    config = AsyncClientConfig(encryption_enabled=False, store_sync_tokens=True)
+    e2ee_enabled = e2ee_requested()
+    store_path = None
+    if e2ee_enabled:
+        store_path = relay_config["matrix"]["e2ee"]["store_path"]
+        os.makedirs(store_path, exist_ok=True)
+
+    config = AsyncClientConfig(encryption_enabled=e2ee_enabled, store_sync_tokens=True)
     matrix_client = AsyncClient(
         matrix_server,
         user_id,
+        device_id=device_id,
+        store_path=store_path,
         config=config,
         ssl=ssl_context,
     )
-    matrix_client.access_token = access_token
+
+    if e2ee_enabled:
+        # Loads the Olm account and all Megolm sessions from the store once;
+        # every later encrypt/decrypt reuses the in-memory sessions.
+        matrix_client.restore_login(user_id, device_id, access_token)
+        matrix_logger.info(f"Loaded E2EE crypto store from '{store_path}'")
+    else:
+        matrix_client.access_token = access_token
 
     try:
-        # Sync to verify connection
-        await matrix_client.sync(timeout=3000)
+        # Sync to verify connection. Without a stored token this is an initial sync, which
+        # carries full room state anyway. With one (E2EE only), nio would otherwise
+        # start with no rooms at all, so ask for full state in that case alone.
+        await matrix_client.sync(timeout=3000, full_state=bool(e2ee_enabled and matrix_client.loaded_sync_token))
         matrix_logger.info("Connected to Matrix server.")
 
+        if e2ee_enabled:
+            await sync_crypto_keys()
+
         # Get bot's display name
         response = await matrix_client.get_displayname(user_id)
         bot_user_name = response.displayname
@@ -61,9 +111,14 @@ async def connect_matrix():
             on_room_message,
             (RoomMessageText, RoomMessageNotice),
         )
+        matrix_client.add_event_callback(on_room_reaction, UnknownEvent)
+        matrix_client.add_response_callback(on_sync_response, SyncResponse)
+        if e2ee_enabled:
+            matrix_client.add_event_callback(on_undecryptable_event, MegolmEvent)
 
         # Subscribe to Meshtastic messages
         pub.subscribe(handle_meshtastic_relay, "meshtastic.send_to_matrix")
+        pub.subscribe(handle_delivery_status, "meshtastic.delivery_status")
 
     except Exception as e:
         matrix_logger.error(f"Failed to connect to Matrix server: {e}")
@@ -72,13 +127,164 @@ async def connect_matrix():
 
     return matrix_client
 
+# Sync errors that retrying won't fix
+FATAL_SYNC_ERRORS = ("M_UNKNOWN_TOKEN", "M_MISSING_TOKEN", "M_FORBIDDEN")
+SYNC_BACKOFF_BASE = 1
+SYNC_BACKOFF_MAX = 60
+
+async def on_sync_response(response: SyncResponse) -> None:
+    global last_sync_time, sync_lag
+    last_sync_time = time.time()
+
+    newest_timestamp = None
+    for room_info in response.rooms.join.values():
+        for event in room_info.timeline.events:
+            timestamp = getattr(event, "server_timestamp", None)
+            if timestamp and (newest_timestamp is None or timestamp > newest_timestamp):
+                newest_timestamp = timestamp
+    if newest_timestamp:
+        sync_lag = max(last_sync_time - newest_timestamp / 1000, 0)
+        matrix_logger.debug(f"Sync lag: {sync_lag:.3f}s")
+
+def sync_backoff(attempt):
+    """
+    Full-jitter exponential backoff, so restarted relays don't retry in lockstep.
+    """
+    return random.uniform(0, min(SYNC_BACKOFF_MAX, SYNC_BACKOFF_BASE * 2 ** attempt))
+
+async def run_sync_loop():
+    """
+    Sync with the homeserver until cancelled, reusing the client and its sync
+    token across errors. Transient errors back off with jitter, rate limits
+    honour retry_after_ms, and errors retrying can't fix end the loop.
+    """
+    attempt = 0
+    matrix_logger.info("Starting Matrix sync loop...")
+    while True:
+        try:
+            response = await matrix_client.sync(timeout=30000)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            delay = sync_backoff(attempt)
+            attempt += 1
+            matrix_logger.warning(f"Error syncing with Matrix server: {e}. Retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+            continue
+
+        if isinstance(response, SyncError):
+            if response.status_code in FATAL_SYNC_ERRORS:
+                matrix_logger.error(f"Matrix sync failed permanently: {response}")
+                return
+            if response.retry_after_ms:
+                delay = response.retry_after_ms / 1000
+            else:
+                delay = sync_backoff(attempt)
+                attempt += 1
+            matrix_logger.warning(f"Matrix sync error: {response}. Retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+            continue
+
+        if attempt:
+            matrix_logger.info("Matrix sync recovered.")
+        attempt = 0
+        await matrix_client.run_response_callbacks([response])
+
+        if matrix_client.olm:
+            try:
+                await matrix_client.send_to_device_messages()
+                await sync_crypto_keys()
+            except Exception as e:
+                matrix_logger.warning(f"Error exchanging encryption keys: {e}")
+
+def e2ee_requested() -> bool:
+    """
+    Check whether E2EE is enabled in the config and usable with the installed nio.
+    """
+    e2ee_config = relay_config["matrix"]["e2ee"]
+    if not e2ee_config.get("enabled", False):
+        return False
+    if not ENCRYPTION_ENABLED:
+        matrix_logger.warning(
+            "E2EE is enabled in config but matrix-nio was installed without the [e2e] extra. "
+            "Encrypted rooms will not be relayed."
+        )
+        return False
+    if not relay_config["matrix"].get("device_id"):
+        matrix_logger.warning("E2EE requires 'device_id' in the matrix config. Encrypted rooms will not be relayed.")
+        return False
+    return True
+
+async def sync_crypto_keys():
+    """
+    Run any pending key upload, query and claim, one batched request each.
+    """
+    if not matrix_client.olm:
+        return
+    if matrix_client.should_upload_keys:
+        await matrix_client.keys_upload()
+    if matrix_client.should_query_keys:
+        await matrix_client.keys_query()
+    if matrix_client.should_claim_keys:
+        await matrix_client.keys_claim(matrix_client.get_users_for_key_claiming())
+
+async def prepare_encrypted_rooms():
+    """
+    Share outbound Megolm sessions ahead of time so the first relayed message
+    into an encrypted room doesn't pay for member sync and key sharing.
+    """
+    if not matrix_client.olm:
+        return
+    for room in relay_settings.rooms:
+        room_id = get_room_id(room["id"])
+        matrix_room = matrix_client.rooms.get(room_id)
+        if not matrix_room or not matrix_room.encrypted:
+            continue
+        try:
+            if not matrix_room.members_synced:
+                await matrix_client.joined_members(room_id)
+            await sync_crypto_keys()
+            if matrix_client.olm.should_share_group_session(room_id):
+                await matrix_client.share_group_session(room_id, ignore_unverified_devices=True)
+            matrix_logger.debug(f"Prepared encryption session for room '{room_id}'")
+        except Exception as e:
+            matrix_logger.warning(f"Could not prepare encryption for room '{room_id}': {e}")
+
+def run_in_background(coro, description):
+    """
+    Start a task the caller won't await. Keeps a reference until it finishes
+    and logs any failure instead of leaving it to "exception was never retrieved".
+    """
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+
+    def done(task):
+        background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            matrix_logger.error(f"Background task failed ({description}): {task.exception()}")
+
+    task.add_done_callback(done)
+    return task
+
+async def on_undecryptable_event(room: MatrixRoom, event: MegolmEvent) -> None:
+    """
+    Request the missing room key without holding up the sync loop. Decryption
+    itself still runs inside nio's sync() as it parses each response; only the
+    key requests for events it couldn't decrypt are moved off the loop.
+    """
+    if event.server_timestamp < bot_start_time:
+        return
+    matrix_logger.warning(f"Unable to decrypt event {event.event_id} in room {room.room_id}. Requesting room key.")
+    if event.session_id not in matrix_client.outgoing_key_requests:
+        run_in_background(matrix_client.request_room_key(event), f"room key request for {event.event_id}")
+
 async def join_matrix_rooms():
     """
     Join the Matrix rooms specified in the configuration.
     """
-    matrix_rooms = relay_config["matrix_rooms"]
-    for room in matrix_rooms:
+    for room in relay_settings.rooms:
         await join_matrix_room(room["id"])
+    await prepare_encrypted_rooms()
 
 async def join_matrix_room(room_id_or_alias: str) -> None:
     """Join a Matrix room by its ID or alias."""
@@ -110,137 +316,519 @@ async def join_matrix_room(room_id_or_alias: str) -> None:
         matrix_logger.error(f"Error joining room '{room_id_or_alias}': {e}")
 
 def update_matrix_room_id(room_id_or_alias: str, resolved_room_id: str):
-    matrix_rooms = relay_config["matrix_rooms"]
-    for room in matrix_rooms:
-        if room["id"] == room_id_or_alias:
-            room["resolved_id"] = resolved_room_id
-            break
+    room = relay_settings.rooms_by_id.get(room_id_or_alias)
+    if room is not None:
+        room["resolved_id"] = resolved_room_id
+        relay_settings.add_resolved_room_id(room, resolved_room_id)
 
 def get_room_id(room_id_or_alias: str) -> str:
     """
     Get the resolved room ID for a given room ID or alias.
     """
-    matrix_rooms = relay_config["matrix_rooms"]
-    for room in matrix_rooms:
-        if room["id"] == room_id_or_alias or room.get("resolved_id") == room_id_or_alias:
-            return room.get("resolved_id", room["id"])
-    return room_id_or_alias  # Return original if not found
-
-async def matrix_relay(room_id_or_alias, message, longname, shortname, meshnet_name):
+    room = relay_settings.rooms_by_id.get(room_id_or_alias)
+    if room is None:
+        return room_id_or_alias  # Return original if not found
+    return room.get("resolved_id", room["id"])
+
+async def matrix_relay(
+    room_id_or_alias,
+    message,
+    longname,
+    shortname,
+    meshnet_name,
+    meshtastic_id=None,
+    meshtastic_text=None,
+    meshtastic_channel=None,
+    reply_id=None,
+    emoji=False,
+    meshtastic_sender=None,
+    trace=None,
+    queued_ns=None,
+):
     room_id = get_room_id(room_id_or_alias)
+    if queued_ns:
+        add_span(trace, "queue_wait", queued_ns, room_id=room_id)
+    error = None
+    if room_id in paused_rooms:
+        matrix_logger.debug(f"Not relaying to paused room {room_id}")
+        finish_trace(trace, error="room paused")
+        return
     try:
-        content = {
-            "msgtype": "m.text",
-            "body": message,
-            "meshtastic_longname": longname,
-            "meshtastic_shortname": shortname,
-            "meshtastic_meshnet": meshnet_name,
-        }
-        await asyncio.wait_for(
-            matrix_client.room_send(
-                room_id=room_id,
-                message_type="m.room.message",
-                content=content,
-            ),
-            timeout=5.0,
+        with span(trace, "db_lookup"):
+            original = get_message_map_by_meshtastic_id(reply_id) if reply_id else None
+        if original and original["matrix_room_id"] != room_id:
+            original = None
+
+        if emoji and original:
+            message_type = "m.reaction"
+            content = {
+                "m.relates_to": {
+                    "rel_type": "m.annotation",
+                    "event_id": original["matrix_event_id"],
+                    "key": meshtastic_text,
+                },
+            }
+        else:
+            message_type = "m.room.message"
+            content = {
+                "msgtype": "m.text",
+                "body": message,
+                "meshtastic_longname": longname,
+                "meshtastic_shortname": shortname,
+                "meshtastic_meshnet": meshnet_name,
+                "meshtastic_text": meshtastic_text,
+            }
+            if original:
+                content["m.relates_to"] = {"m.in_reply_to": {"event_id": original["matrix_event_id"]}}
+
+        send_as_node = (
+            appservice_utils.appservice_enabled
+            and meshtastic_sender
+            and room_id not in appservice_utils.encrypted_rooms
         )
+
+        with span(trace, "matrix_send", room_id=room_id):
+            if send_as_node:
+                # The virtual user's display name carries the sender, so the body is just the text
+                if message_type == "m.room.message":
+                    content["body"] = meshtastic_text
+                event_id = await asyncio.wait_for(
+                    appservice_utils.send_as_virtual_user(
+                        room_id, meshtastic_sender, f"{longname}/{meshnet_name}", message_type, content
+                    ),
+                    timeout=5.0,
+                )
+            else:
+                response = await asyncio.wait_for(
+                    matrix_client.room_send(
+                        room_id=room_id,
+                        message_type=message_type,
+                        content=content,
+                        ignore_unverified_devices=True,
+                    ),
+                    timeout=5.0,
+                )
+                event_id = getattr(response, "event_id", None)
         matrix_logger.info(f"Sent inbound radio message to matrix room: {room_id}")
+
+        if message_type == "m.room.message" and meshtastic_id is not None and event_id:
+            with span(trace, "db_save"):
+                save_message_map(meshtastic_id, event_id, room_id, meshtastic_text, meshtastic_channel)
     except asyncio.TimeoutError:
         matrix_logger.error("Timed out while waiting for Matrix response")
+        error = "timeout"
     except Exception as e:
         matrix_logger.error(f"Error sending radio message to matrix room {room_id}: {e}")
-
-def handle_meshtastic_relay(room_id, message, longname, shortname, meshnet_name):
+        error = e
+    finally:
+        finish_trace(trace, error=error)
+
+def handle_meshtastic_relay(
+    room_id,
+    message,
+    longname,
+    shortname,
+    meshnet_name,
+    meshtastic_id=None,
+    meshtastic_text=None,
+    meshtastic_channel=None,
+    reply_id=None,
+    emoji=False,
+    meshtastic_sender=None,
+    trace=None,
+):
     if matrix_event_loop is None:
         matrix_logger.error("matrix_event_loop is None")
+        finish_trace(trace, error="no event loop")
         return
     matrix_logger.debug(f"handle_meshtastic_relay called with room_id={room_id}, message='{message}'")
-    asyncio.run_coroutine_threadsafe(
+    future = asyncio.run_coroutine_threadsafe(
         matrix_relay(
             room_id,
             message,
             longname,
             shortname,
             meshnet_name,
+            meshtastic_id=meshtastic_id,
+            meshtastic_text=meshtastic_text,
+            meshtastic_channel=meshtastic_channel,
+            reply_id=reply_id,
+            emoji=emoji,
+            meshtastic_sender=meshtastic_sender,
+            trace=trace,
+            queued_ns=time.time_ns() if trace else None,
         ),
         loop=matrix_event_loop,
     )
+    pending_relays.add(future)
+    future.add_done_callback(pending_relays.discard)
+
+def handle_delivery_status(matrix_room_id, matrix_event_id, delivered, reason=None):
+    if matrix_event_loop is None:
+        return
+    asyncio.run_coroutine_threadsafe(
+        send_delivery_receipt(matrix_room_id, matrix_event_id, delivered, reason),
+        loop=matrix_event_loop,
+    )
 
-def truncate_message(text, max_bytes=227):
+async def send_delivery_receipt(room_id, event_id, delivered, reason=None):
     """
-    Truncate the given text to fit within the specified byte size.
+    Show the radio delivery outcome on the original Matrix message, as a
+    reaction or (for successes) the bot's read marker.
     """
-    truncated_text = text.encode("utf-8")[:max_bytes].decode("utf-8", "ignore")
-    return truncated_text
+    receipts = relay_config["meshtastic"]["delivery_receipts"]
+    if receipts == "none":
+        return
+    try:
+        if delivered and receipts == "read_marker":
+            await matrix_client.room_read_markers(room_id, event_id, event_id)
+        else:
+            await matrix_client.room_send(
+                room_id=room_id,
+                message_type="m.reaction",
+                content={
+                    "m.relates_to": {
+                        "rel_type": "m.annotation",
+                        "event_id": event_id,
+                        "key": "✅" if delivered else "❌",
+                    },
+                },
+                ignore_unverified_devices=True,
+            )
+        if not delivered:
+            matrix_logger.warning(f"Message {event_id} was not delivered to the mesh: {reason}")
+    except Exception as e:
+        matrix_logger.warning(f"Could not send delivery receipt for {event_id}: {e}")
+
+def flush_pending_relays():
+    """
+    Drop radio messages that haven't been sent to Matrix yet.
+    """
+    flushed = 0
+    for future in list(pending_relays):
+        if future.cancel():
+            flushed += 1
+    return flushed
+
+def build_radio_message(prefix, text):
+    """
+    Prefix and truncate text to the configured radio payload size.
+    """
+    return build_message(
+        prefix,
+        text,
+        relay_settings.max_message_bytes,
+        relay_settings.grapheme_safe_truncation,
+    )
+
+def strip_remote_prefix(text, full_display_name):
+    """
+    Remove the "[longname/meshnet]: " prefix another relay put in front of the text.
+    """
+    prefix = f"[{full_display_name}]: "
+    if text.startswith(prefix):
+        return text[len(prefix):]
+    return text
+
+def strip_reply_fallback(text):
+    """
+    Remove the quoted "> <@user> ..." fallback that Matrix clients prepend to replies.
+    """
+    lines = text.split("\n")
+    index = 0
+    while index < len(lines) and lines[index].startswith(">"):
+        index += 1
+    if index == 0:
+        return text
+    return "\n".join(lines[index:]).strip()
+
+def edit_delta(old_text, new_text):
+    """
+    Return only the changed span of an edit, marking trimmed context with an ellipsis.
+    """
+    limit = min(len(old_text), len(new_text))
+    start = 0
+    while start < limit and old_text[start] == new_text[start]:
+        start += 1
+    end = 0
+    while end < limit - start and old_text[-1 - end] == new_text[-1 - end]:
+        end += 1
+    changed = new_text[start:len(new_text) - end].strip()
+    if not changed:
+        return None
+    return f"{'…' if start else ''}{changed}{'…' if end else ''}"
+
+async def get_sender_display_name(room: MatrixRoom, user_id: str) -> str:
+    """
+    Resolve a sender's display name from synced room state, then the cache,
+    and only then from the homeserver.
+    """
+    if user_id in room.users:
+        return room.users[user_id].name
+    displayname = displayname_cache.get(user_id)
+    if displayname is None:
+        response = await matrix_client.get_displayname(user_id)
+        displayname = getattr(response, "displayname", None) or user_id
+        displayname_cache.set(user_id, displayname)
+    return displayname
+
+def get_relations(event):
+    try:
+        return event.source["content"].get("m.relates_to") or {}
+    except AttributeError:
+        return {}
+
+def get_room_config(room_id):
+    room = relay_settings.rooms_by_id.get(room_id)
+    if room is None or get_room_id(room["id"]) != room_id:
+        return None  # An alias that hasn't been resolved yet, or a room we don't relay
+    return room
 
 async def on_room_message(room: MatrixRoom, event: Union[RoomMessageText, RoomMessageNotice]) -> None:
+    capture_matrix_event(room.room_id, event.source)
+    await process_room_message(room, event)
+
+async def process_room_message(room: MatrixRoom, event: Union[RoomMessageText, RoomMessageNotice]) -> None:
+    """
+    Everything after capture: skip checks and the relay itself, which applies the rate limit.
+    Delayed messages come back through here so they are only captured once.
+    """
     if event.sender == matrix_client.user_id:
         return  # Skip processing if the message is from the bot itself
 
-    full_display_name = "Unknown user"
-
     message_timestamp = event.server_timestamp
 
     if message_timestamp < bot_start_time:
         # Ignore old messages
         return
 
-    text = event.body.strip()
+    if room.room_id in paused_rooms:
+        matrix_logger.debug(f"Ignoring message in paused room {room.room_id}")
+        return
 
-    # Handle events with missing or malformed content
+    room_config = get_room_config(room.room_id)
+    if room_config and not owns_room(room_config["id"]):
+        matrix_logger.debug(f"Room {room.room_id} is owned by another worker")
+        return
+
+    trace = start_trace("matrix_to_meshtastic", event_id=event.event_id, room_id=room.room_id)
     try:
-        longname = event.source["content"].get("meshtastic_longname")
-        shortname = event.source["content"].get("meshtastic_shortname", None)
-        meshnet_name = event.source["content"].get("meshtastic_meshnet")
-    except AttributeError:
-        # Handle cases where 'content' is None or missing expected keys
-        longname = None
-        shortname = None
-        meshnet_name = None
+        await relay_room_message(room, event, trace)
+    finally:
+        finish_trace(trace)
 
-    local_meshnet_name = relay_config["meshtastic"]["meshnet_name"]
+async def handle_rate_limited(room: MatrixRoom, event, room_config, settings, wait) -> None:
+    """
+    Drop, delay or summarize a message that is over its sender or room limit.
+    """
+    action = settings["action"]
+    if action == "delay" and delayed_counts.get(room.room_id, 0) < settings["max_delayed"]:
+        matrix_logger.info(f"Rate limit reached for {event.sender} in {room.room_id}. Delaying {wait:.1f}s")
+        delayed_counts[room.room_id] = delayed_counts.get(room.room_id, 0) + 1
+        run_in_background(relay_delayed_message(room, event, wait), f"delayed relay of {event.event_id}")
+        return
 
-    if longname and meshnet_name:
+    if action == "summarize":
+        key = (room.room_id, event.sender)
+        suppressed_counts[key] = suppressed_counts.get(key, 0) + 1
+        if suppressed_counts[key] == 1:
+            run_in_background(
+                send_rate_limit_summary(room, event.sender, room_config, wait), f"rate limit summary for {event.sender}"
+            )
+    else:
+        matrix_logger.info(f"Rate limit reached for {event.sender} in {room.room_id}. Dropping message")
+
+    if settings["notify_sender"]:
+        await notify_rate_limited(room, event.sender, wait)
+
+async def relay_delayed_message(room: MatrixRoom, event, wait) -> None:
+    try:
+        await asyncio.sleep(wait)
+    finally:
+        delayed_counts[room.room_id] -= 1
+    await process_room_message(room, event)
+
+async def send_rate_limit_summary(room: MatrixRoom, sender, room_config, wait) -> None:
+    await asyncio.sleep(wait)
+    count = suppressed_counts.pop((room.room_id, sender), 0)
+    if not count:
+        return
+    full_display_name = await get_sender_display_name(room, sender)
+    summary = build_radio_message(
+        f"{full_display_name[:5]}[M]: ", f"({count} more msg{'s' if count > 1 else ''} not relayed)"
+    )
+    matrix_logger.info(f"Sending rate limit summary for {sender}: {count} messages")
+    pub.sendMessage(
+        "matrix.send_to_meshtastic",
+        text=summary,
+        channelIndex=room_config["meshtastic_channel"],
+    )
+
+async def notify_rate_limited(room: MatrixRoom, sender, wait) -> None:
+    """
+    Tell a sender, at most once per limit window, that the mesh isn't getting their messages.
+    """
+    now = time.monotonic()
+    last_notice = rate_limit_notices.get(sender)
+    if last_notice and now - last_notice < wait:
+        return
+    rate_limit_notices.set(sender, now)
+    try:
+        await matrix_client.room_send(
+            room_id=room.room_id,
+            message_type="m.room.message",
+            content={
+                "msgtype": "m.notice",
+                "body": f"{sender}: you are sending faster than the mesh can carry, so your "
+                f"messages are not being relayed. Try again in about {int(wait) + 1}s.",
+            },
+            ignore_unverified_devices=True,
+        )
+    except Exception as e:
+        matrix_logger.warning(f"Could not send rate limit notice to {sender}: {e}")
+
+async def relay_room_message(room: MatrixRoom, event: Union[RoomMessageText, RoomMessageNotice], trace=None) -> None:
+    full_display_name = "Unknown user"
+
+    # Handle events with missing or malformed content
+    content = event.source.get("content") or {}
+    longname = content.get("meshtastic_longname")
+    shortname = content.get("meshtastic_shortname")
+    meshnet_name = content.get("meshtastic_meshnet")
+    is_remote = bool(longname and meshnet_name)
+
+    if is_remote and meshnet_name == relay_settings.meshnet_name:
+        return  # Our own meshnet, relayed by another bridge; the radio already has it
+
+    text = event.body.strip()
+
+    relates_to = get_relations(event)
+    original = None
+    reply_id = None
+    if relates_to.get("rel_type") == "m.replace":
+        with span(trace, "db_lookup"):
+            original = get_message_map_by_event_id(relates_to.get("event_id"))
+        edit_mode = relay_config["meshtastic"]["relay_edits"]
+        if edit_mode != "delta" or not original:
+            matrix_logger.debug(f"Not relaying edit {event.event_id} to the mesh")
+            return
+        new_content = content.get("m.new_content") or {}
+        text = (new_content.get("meshtastic_text") or new_content.get("body") or text).strip()
+    elif "m.in_reply_to" in relates_to:
+        with span(trace, "db_lookup"):
+            replied = get_message_map_by_event_id(relates_to["m.in_reply_to"].get("event_id"))
+        if replied:
+            reply_id = replied["meshtastic_id"]
+        text = strip_reply_fallback(text)
+
+    if is_remote:
         full_display_name = f"{longname}/{meshnet_name}"
-        if meshnet_name != local_meshnet_name:
-            matrix_logger.info(f"Processing message from remote meshnet: {text}")
-            short_meshnet_name = meshnet_name[:4]
-
-            if shortname is None:
-                shortname = longname[:3]
-            prefix = f"{shortname}/{short_meshnet_name}: "
-            text = re.sub(rf"^\[{re.escape(full_display_name)}\]: ", "", text)
-            text = truncate_message(text)
-            full_message = f"{prefix}{text}"
+        if original is None and content.get("meshtastic_text") is not None:
+            text = content["meshtastic_text"]
         else:
+            # Relays that predate meshtastic_text only send "[longname/meshnet]: text"
+            text = strip_remote_prefix(text, full_display_name)
+
+    room_config = get_room_config(room.room_id)
+    if room_config:
+        with span(trace, "filters"):
+            text = apply_filters(room_config, text)
+        if text is None:
+            matrix_logger.debug(f"Message {event.event_id} dropped by room filters")
             return
+
+    if is_remote:
+        matrix_logger.info(f"Processing message from remote meshnet: {text}")
+        short_meshnet_name = meshnet_name[:4]
+
+        if shortname is None:
+            shortname = longname[:3]
+        prefix = f"{shortname}/{short_meshnet_name}: "
+        full_message = build_radio_message(prefix, text)
     else:
-        display_name_response = await matrix_client.get_displayname(
-            event.sender
-        )
-        full_display_name = display_name_response.displayname or event.sender
+        with span(trace, "displayname_lookup"):
+            full_display_name = await get_sender_display_name(room, event.sender)
         short_display_name = full_display_name[:5]
         prefix = f"{short_display_name}[M]: "
         matrix_logger.info(f"Processing matrix message from [{full_display_name}]: {text}")
-        text = truncate_message(text)
-        full_message = f"{prefix}{text}"
+        full_message = build_radio_message(prefix, text)
 
-    room_config = None
-    for config in relay_config["matrix_rooms"]:
-        if get_room_id(config["id"]) == room.room_id:
-            room_config = config
-            break
+    edited_message = full_message
+    if original:
+        # Diff against what the mesh last received, so a second edit only sends what's new
+        delta = edit_delta(original["meshtastic_text"], full_message)
+        if not delta:
+            return
+        full_message = build_radio_message(prefix, f"* {delta}")
 
     if room_config:
         meshtastic_channel = room_config["meshtastic_channel"]
 
-        if relay_config["meshtastic"].get("broadcast_enabled", True):
+        if relay_settings.broadcast_enabled:
+            # Only messages that would really go out use up the sender's and room's quota
+            settings = get_rate_limit_settings(room_config)
+            wait = check_rate_limit(room.room_id, event.sender, settings)
+            if wait:
+                await handle_rate_limited(room, event, room_config, settings, wait)
+                return
+
             matrix_logger.info(
                 f"Sending radio message from {full_display_name} to radio broadcast"
             )
             matrix_logger.debug(f"Publishing message to Meshtastic: {full_message}")
-            pub.sendMessage("matrix.send_to_meshtastic", text=full_message, channelIndex=meshtastic_channel)
+            set_attributes(trace, channel=meshtastic_channel)
+            hold_trace(trace)
+            pub.sendMessage(
+                "matrix.send_to_meshtastic",
+                text=full_message,
+                channelIndex=meshtastic_channel,
+                reply_id=reply_id,
+                matrix_event_id=event.event_id,
+                matrix_room_id=room.room_id,
+                trace=trace,
+            )
+            if original:
+                update_message_map_text(original, edited_message)
         else:
             matrix_logger.debug(
                 f"Broadcast not supported: Message from {full_display_name} dropped."
             )
+
+async def on_room_reaction(room: MatrixRoom, event: UnknownEvent) -> None:
+    if event.type == "m.reaction":
+        capture_matrix_event(room.room_id, event.source)
+        await process_room_reaction(room, event)
+
+async def process_room_reaction(room: MatrixRoom, event: UnknownEvent) -> None:
+    """
+    Relay Matrix reactions to messages that were exchanged with the mesh.
+    """
+    if event.type != "m.reaction" or event.sender == matrix_client.user_id:
+        return
+    if room.room_id in paused_rooms:
+        return
+    if event.server_timestamp < bot_start_time:
+        return
+    if not relay_config["meshtastic"]["relay_reactions"]:
+        return
+
+    relates_to = event.source.get("content", {}).get("m.relates_to", {})
+    original = get_message_map_by_event_id(relates_to.get("event_id"))
+    room_config = get_room_config(room.room_id)
+    if not original or not room_config or not relates_to.get("key"):
+        return
+    if not owns_room(room_config["id"]):
+        return
+    if check_rate_limit(room.room_id, event.sender, get_rate_limit_settings(room_config)):
+        matrix_logger.debug(f"Rate limit reached for {event.sender}. Dropping reaction")
+        return
+
+    full_display_name = await get_sender_display_name(room, event.sender)
+    reaction = build_radio_message(f"{full_display_name[:5]}[M]: ", relates_to["key"])
+    matrix_logger.info(f"Relaying reaction from {full_display_name} to radio broadcast")
+    pub.sendMessage(
+        "matrix.send_to_meshtastic",
+        text=reaction,
+        channelIndex=room_config["meshtastic_channel"],
+        reply_id=original["meshtastic_id"],
+    )
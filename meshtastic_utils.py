@@ -2,14 +2,19 @@ import asyncio
 import threading
 import time
 
-import meshtastic.tcp_interface
-import meshtastic.serial_interface
-import serial.tools.list_ports
 from pubsub import pub
 
-from config import relay_config
-from db_utils import save_longname, save_shortname, get_longname, get_shortname
+from capture_utils import capture_meshtastic_packet
+from config import relay_config, relay_settings
+from db_utils import (
+    save_names,
+    get_longname,
+    get_shortname,
+    save_message_map,
+)
 from log_utils import get_logger
+from shard_utils import owns_room
+from trace_utils import start_trace, span, add_span, set_attributes, hold_trace, finish_trace
 
 meshtastic_logger = get_logger("Meshtastic")
 
@@ -20,11 +25,19 @@ meshtastic_lock = threading.Lock()
 reconnecting = False
 shutting_down = False
 reconnect_task = None
+paused_channels = set()  # Channels paused through the admin API
+pending_relays = set()  # Inbound packets scheduled on the event loop but not yet handled
+pending_acks = {}  # Packet ID -> details of a wantAck send still waiting for its routing ACK
+
+# Routing errors worth spending airtime on a retry for; the rest won't go away by resending
+RETRYABLE_ROUTING_ERRORS = ("MAX_RETRANSMIT", "TIMEOUT", "NO_RESPONSE", "DUTY_CYCLE_LIMIT", "RATE_LIMIT_EXCEEDED")
 
 def serial_port_exists(port_name):
     """
     Check if the specified serial port exists.
     """
+    import serial.tools.list_ports
+
     ports = [port.device for port in serial.tools.list_ports.comports()]
     return port_name in ports
 
@@ -68,10 +81,15 @@ async def connect_meshtastic(force_connect=False):
                         attempts += 1
                         continue
 
+                    # Only load the interface we use; the meshtastic package is slow to import
+                    import meshtastic.serial_interface
+
                     meshtastic_interface = meshtastic.serial_interface.SerialInterface(serial_port)
                 else:
                     target_host = relay_config["meshtastic"]["host"]
                     meshtastic_logger.info(f"Connecting to radio at {target_host} ...")
+                    import meshtastic.tcp_interface
+
                     meshtastic_interface = meshtastic.tcp_interface.TCPInterface(hostname=target_host)
 
                 successful = True
@@ -137,6 +155,7 @@ async def reconnect():
             await connect_meshtastic(force_connect=True)
             if meshtastic_interface:
                 meshtastic_logger.info("Reconnected to Meshtastic device.")
+                update_node_names()
                 break
 
             meshtastic_logger.warning(f"Reconnection failed. Retrying in {backoff_time} seconds...")
@@ -149,30 +168,31 @@ async def reconnect():
     finally:
         reconnecting = False
 
-def update_longnames():
-    if meshtastic_interface and meshtastic_interface.nodes:
-        for node in meshtastic_interface.nodes.values():
-            user = node.get("user")
-            if user:
-                meshtastic_id = user["id"]
-                longname = user.get("longName", "N/A")
-                save_longname(meshtastic_id, longname)
-
-def update_shortnames():
+def update_node_names():
+    """
+    Save the longname and shortname of every node the radio knows about.
+    """
     if meshtastic_interface and meshtastic_interface.nodes:
-        for node in meshtastic_interface.nodes.values():
+        names = []
+        for node in list(meshtastic_interface.nodes.values()):
             user = node.get("user")
             if user:
-                meshtastic_id = user["id"]
-                shortname = user.get("shortName", "N/A")
-                save_shortname(meshtastic_id, shortname)
+                names.append((user["id"], user.get("longName", "N/A"), user.get("shortName", "N/A")))
+        save_names(names)
+        meshtastic_logger.debug(f"Updated names for {len(names)} nodes")
 
-def truncate_message(text, max_bytes=227):
+async def run_node_refresh():
     """
-    Truncate the given text to fit within the specified byte size.
+    Keep the node name tables current, independent of the Matrix sync loop.
     """
-    truncated_text = text.encode("utf-8")[:max_bytes].decode("utf-8", "ignore")
-    return truncated_text
+    interval = relay_config["meshtastic"]["node_refresh_interval"]
+    while True:
+        if meshtastic_interface:
+            try:
+                update_node_names()
+            except Exception as e:
+                meshtastic_logger.warning(f"Error updating node names: {e}")
+        await asyncio.sleep(interval)
 
 def on_meshtastic_message(packet, interface):
     """
@@ -181,10 +201,31 @@ def on_meshtastic_message(packet, interface):
     if shutting_down:
         return
 
-    asyncio.run_coroutine_threadsafe(handle_meshtastic_message(packet), meshtastic_event_loop)
+    capture_meshtastic_packet(packet)
+
+    trace = None
+    if packet.get("decoded", {}).get("text"):
+        trace = start_trace("meshtastic_to_matrix", packet_id=packet.get("id"), sender=packet.get("fromId"))
+
+    future = asyncio.run_coroutine_threadsafe(handle_meshtastic_message(packet, trace), meshtastic_event_loop)
+    pending_relays.add(future)
+    future.add_done_callback(pending_relays.discard)
 
-async def handle_meshtastic_message(packet):
+def flush_pending_relays():
+    """
+    Drop inbound packets that are still waiting to be handled.
+    """
+    flushed = 0
+    for future in list(pending_relays):
+        if future.cancel():
+            flushed += 1
+    return flushed
+
+async def handle_meshtastic_message(packet, trace=None):
     sender = packet["fromId"]
+    if trace is not None:
+        # Time spent between the reader thread and the event loop
+        add_span(trace, "queue_wait", trace.start_ns)
 
     if "text" in packet["decoded"] and packet["decoded"]["text"]:
         text = packet["decoded"]["text"]
@@ -196,43 +237,65 @@ async def handle_meshtastic_message(packet):
                 channel = 0
             else:
                 meshtastic_logger.debug("Unknown packet")
+                finish_trace(trace, error="unknown packet")
                 return
 
         # Check if the channel is mapped to a Matrix room in the configuration
-        channel_mapped = False
-        for room in relay_config["matrix_rooms"]:
-            if room["meshtastic_channel"] == channel:
-                channel_mapped = True
-                break
-
-        if not channel_mapped:
+        rooms = relay_settings.rooms_by_channel.get(channel)
+        if not rooms:
             meshtastic_logger.debug(f"Skipping message from unmapped channel {channel}")
+            finish_trace(trace, error="unmapped channel")
+            return
+
+        if channel in paused_channels:
+            meshtastic_logger.debug(f"Skipping message from paused channel {channel}")
+            finish_trace(trace, error="channel paused")
             return
 
         meshtastic_logger.info(f"Processing inbound radio message from {sender} on channel {channel}")
 
-        longname = get_longname(sender) or sender
-        shortname = get_shortname(sender) or sender
-        meshnet_name = relay_config["meshtastic"]["meshnet_name"]
+        with span(trace, "db_lookup"):
+            longname = get_longname(sender) or sender
+            shortname = get_shortname(sender) or sender
+        meshnet_name = relay_settings.meshnet_name
 
         formatted_message = f"[{longname}/{meshnet_name}]: {text}"
         meshtastic_logger.info(f"Relaying Meshtastic message from {longname} to Matrix: {formatted_message}")
 
+        # Replies and tapback reactions point at the packet ID of the original message
+        reply_id = packet["decoded"].get("replyId")
+        emoji = bool(packet["decoded"].get("emoji"))
+
+        set_attributes(trace, channel=channel)
+
         # Publish the message to be sent to Matrix
-        for room in relay_config["matrix_rooms"]:
-            if room["meshtastic_channel"] == channel:
-                meshtastic_logger.debug(f"Publishing message to Matrix room {room['id']}")
-                pub.sendMessage(
-                    "meshtastic.send_to_matrix",
-                    room_id=room["id"],
-                    message=formatted_message,
-                    longname=longname,
-                    shortname=shortname,
-                    meshnet_name=meshnet_name,
-                )
+        for room in rooms:
+            if not owns_room(room["id"]):
+                meshtastic_logger.debug(f"Room {room['id']} is owned by another worker")
+                continue
+            meshtastic_logger.debug(f"Publishing message to Matrix room {room['id']}")
+            hold_trace(trace)
+            pub.sendMessage(
+                "meshtastic.send_to_matrix",
+                room_id=room["id"],
+                message=formatted_message,
+                longname=longname,
+                shortname=shortname,
+                meshnet_name=meshnet_name,
+                meshtastic_id=packet.get("id"),
+                meshtastic_text=text,
+                meshtastic_channel=channel,
+                reply_id=reply_id,
+                emoji=emoji,
+                meshtastic_sender=sender,
+                trace=trace,
+            )
+        finish_trace(trace)
     else:
         portnum = packet["decoded"]["portnum"]
-        if portnum == "TELEMETRY_APP":
+        if portnum == "ROUTING_APP":
+            handle_routing_packet(packet)
+        elif portnum == "TELEMETRY_APP":
             meshtastic_logger.debug("Ignoring Telemetry packet")
         elif portnum == "POSITION_APP":
             meshtastic_logger.debug("Ignoring Position packet")
@@ -241,13 +304,118 @@ async def handle_meshtastic_message(packet):
         else:
             meshtastic_logger.debug("Ignoring Unknown packet")
 
-def send_to_meshtastic_from_matrix(text, channelIndex):
+def send_to_meshtastic_from_matrix(
+    text, channelIndex, reply_id=None, matrix_event_id=None, matrix_room_id=None, trace=None, attempt=1
+):
     meshtastic_logger.debug(f"send_to_meshtastic_from_matrix called with text='{text}', channelIndex={channelIndex}")
+    if channelIndex in paused_channels:
+        meshtastic_logger.debug(f"Not sending to paused channel {channelIndex}")
+        finish_trace(trace, error="channel paused")
+        return
     if meshtastic_interface:
         try:
-            meshtastic_interface.sendText(text=text, channelIndex=channelIndex)
+            want_ack = relay_config["meshtastic"]["want_ack"]
+            send_kwargs = {}
+            if reply_id is not None:
+                send_kwargs["replyId"] = reply_id
+            if want_ack:
+                send_kwargs["wantAck"] = True
+            with span(trace, "radio_send", channel=channelIndex, attempt=attempt):
+                sent_packet = meshtastic_interface.sendText(text=text, channelIndex=channelIndex, **send_kwargs)
             meshtastic_logger.info("Sent message to Meshtastic")
+            if matrix_event_id and sent_packet is not None:
+                set_attributes(trace, packet_id=sent_packet.id)
+                with span(trace, "db_save"):
+                    save_message_map(sent_packet.id, matrix_event_id, matrix_room_id, text, channelIndex)
+            if want_ack and sent_packet is not None:
+                # The trace stays open until the ACK arrives or we give up
+                pending_acks[sent_packet.id] = {
+                    "text": text,
+                    "channel": channelIndex,
+                    "reply_id": reply_id,
+                    "matrix_event_id": matrix_event_id,
+                    "matrix_room_id": matrix_room_id,
+                    "trace": trace,
+                    "attempt": attempt,
+                    "sent_ns": time.time_ns(),
+                    "deadline": time.monotonic() + relay_config["meshtastic"]["ack_timeout"],
+                }
+            else:
+                finish_trace(trace)
         except Exception as e:
             meshtastic_logger.error(f"Error sending message to Meshtastic: {e}")
+            report_send_failure(trace, matrix_event_id, matrix_room_id, str(e))
     else:
         meshtastic_logger.warning("Cannot send message: Meshtastic client is not connected.")
+        report_send_failure(trace, matrix_event_id, matrix_room_id, "not connected")
+
+def report_send_failure(trace, matrix_event_id, matrix_room_id, reason):
+    """
+    A wantAck send (or its retry) that never reached the radio gets a failed receipt, not silence.
+    """
+    if not relay_config["meshtastic"]["want_ack"]:
+        finish_trace(trace, error=reason)
+        return
+    report_delivery(
+        {"trace": trace, "matrix_event_id": matrix_event_id, "matrix_room_id": matrix_room_id}, False, reason
+    )
+
+def handle_routing_packet(packet):
+    """
+    Resolve a pending wantAck send from the ACK or NAK the radio reports for it.
+    """
+    request_id = packet["decoded"].get("requestId")
+    pending = pending_acks.pop(request_id, None)
+    if pending is None:
+        return
+    add_span(pending["trace"], "ack", pending["sent_ns"])
+    # MessageToDict leaves out the default errorReason, which is NONE (success)
+    error_reason = packet["decoded"].get("routing", {}).get("errorReason", "NONE")
+    if error_reason == "NONE":
+        meshtastic_logger.debug(f"Packet {request_id} acknowledged")
+        report_delivery(pending, True)
+    elif error_reason in RETRYABLE_ROUTING_ERRORS:
+        retry_or_fail(pending, error_reason)
+    else:
+        meshtastic_logger.warning(f"Packet {request_id} was rejected: {error_reason}")
+        report_delivery(pending, False, error_reason)
+
+def retry_or_fail(pending, reason):
+    max_retries = relay_config["meshtastic"]["max_retries"]
+    if pending["attempt"] > max_retries:
+        meshtastic_logger.warning(f"Giving up on message after {pending['attempt']} attempts: {reason}")
+        report_delivery(pending, False, reason)
+        return
+    meshtastic_logger.info(f"Message not delivered ({reason}). Retrying (attempt {pending['attempt'] + 1})")
+    send_to_meshtastic_from_matrix(
+        pending["text"],
+        pending["channel"],
+        reply_id=pending["reply_id"],
+        matrix_event_id=pending["matrix_event_id"],
+        matrix_room_id=pending["matrix_room_id"],
+        trace=pending["trace"],
+        attempt=pending["attempt"] + 1,
+    )
+
+def report_delivery(pending, delivered, reason=None):
+    finish_trace(pending["trace"], error=None if delivered else reason)
+    if pending["matrix_event_id"]:
+        pub.sendMessage(
+            "meshtastic.delivery_status",
+            matrix_room_id=pending["matrix_room_id"],
+            matrix_event_id=pending["matrix_event_id"],
+            delivered=delivered,
+            reason=reason,
+        )
+
+async def run_ack_monitor():
+    """
+    Retry or fail wantAck sends whose ACK never arrived. Nothing waits on the
+    radio in the meantime; this only looks at the pending table once a second.
+    """
+    while True:
+        await asyncio.sleep(1)
+        now = time.monotonic()
+        expired = [packet_id for packet_id, pending in pending_acks.items() if pending["deadline"] <= now]
+        for packet_id in expired:
+            retry_or_fail(pending_acks.pop(packet_id), "TIMEOUT")
@@ -0,0 +1,74 @@
+import time
+from collections import deque
+
+from cache_utils import LRUCache
+from config import relay_config
+
+rate_limit_config = relay_config["rate_limit"]
+
+DEFAULT_RATE_LIMIT = {
+    "enabled": False,
+    "sender_messages": 5,
+    "sender_window": 60,
+    "room_messages": 20,
+    "room_window": 60,
+    "action": "drop",  # drop, delay or summarize
+    "max_delayed": 20,
+    "notify_sender": True,
+}
+
+# Timestamps of recently relayed messages, oldest first, per sender and per room
+sender_windows = LRUCache(rate_limit_config.get("tracked_senders", 1000))
+room_windows = {}
+_room_settings = {}
+
+def get_rate_limit_settings(room_config):
+    """
+    Merge defaults, the global rate_limit section and the room's own override, once per room.
+    """
+    settings = _room_settings.get(room_config["id"])
+    if settings is None:
+        settings = dict(DEFAULT_RATE_LIMIT)
+        settings.update({key: value for key, value in rate_limit_config.items() if key in DEFAULT_RATE_LIMIT})
+        settings.update(room_config.get("rate_limit") or {})
+        _room_settings[room_config["id"]] = settings
+    return settings
+
+def _current_window(window, now, length):
+    while window and window[0] <= now - length:
+        window.popleft()
+    return window
+
+def _wait_time(window, limit, length, now):
+    if len(window) < limit:
+        return 0
+    return window[0] + length - now
+
+def check_rate_limit(room_id, sender, settings):
+    """
+    Count a message from `sender` in `room_id` and return 0 if it is within
+    both limits. Otherwise return the seconds until it would be, without counting it.
+    """
+    if not settings["enabled"]:
+        return 0
+    now = time.monotonic()
+
+    sender_window = sender_windows.get(sender)
+    if sender_window is None:
+        sender_window = deque()
+        sender_windows.set(sender, sender_window)
+    _current_window(sender_window, now, settings["sender_window"])
+
+    room_window = room_windows.setdefault(room_id, deque())
+    _current_window(room_window, now, settings["room_window"])
+
+    wait = max(
+        _wait_time(sender_window, settings["sender_messages"], settings["sender_window"], now),
+        _wait_time(room_window, settings["room_messages"], settings["room_window"], now),
+    )
+    if wait > 0:
+        return wait
+
+    sender_window.append(now)
+    room_window.append(now)
+    return 0
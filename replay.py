@@ -0,0 +1,139 @@
+"""
+Replay captured Meshtastic packets and Matrix events through the relay
+against stand-in radio and Matrix interfaces, and report throughput.
+
+    python replay.py capture.jsonl --speed 1   # real time
+    python replay.py capture.jsonl --speed 10  # ten times faster
+    python replay.py capture.jsonl --speed 0   # as fast as possible
+
+Messages the relay sends are counted, not delivered. The message map is
+written to meshtastic.sqlite in the working directory, so run replays in a
+scratch copy of the relay directory rather than next to a live install.
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+from nio import MatrixRoom, RoomMessageNotice, RoomMessageText, UnknownEvent
+from nio.events.room_events import Event
+from pubsub import pub
+
+import capture_utils
+from capture_utils import read_capture
+from db_utils import initialize_database
+from log_utils import get_logger
+import matrix_utils
+import meshtastic_utils
+
+logger = get_logger("Replay")
+
+class StandInResponse:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+class StandInMeshtasticInterface:
+    """
+    Accepts sends like a radio would, without any I/O.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.sent = 0
+        self._packet_ids = itertools.count(1)
+
+    def sendText(self, text, channelIndex=0, **kwargs):
+        self.sent += 1
+        return StandInResponse(id=next(self._packet_ids))
+
+    def close(self):
+        pass
+
+class StandInMatrixClient:
+    """
+    Accepts room sends and display name lookups like a homeserver would, without any I/O.
+    """
+
+    def __init__(self, user_id="@m2mlite-replay:localhost"):
+        self.user_id = user_id
+        self.rooms = {}
+        self.olm = None
+        self.sent = 0
+        self._event_ids = itertools.count(1)
+
+    async def room_send(self, room_id, message_type, content, **kwargs):
+        self.sent += 1
+        return StandInResponse(event_id=f"$replay{next(self._event_ids)}", room_id=room_id)
+
+    async def get_displayname(self, user_id):
+        return StandInResponse(displayname=user_id.split(":")[0].lstrip("@"))
+
+    async def close(self):
+        pass
+
+async def dispatch(record, own_user_id):
+    if record["source"] == "meshtastic":
+        await meshtastic_utils.handle_meshtastic_message(record["packet"])
+        return
+
+    event = Event.parse_event(record["event"])
+    room = MatrixRoom(record["room_id"], own_user_id)
+    if isinstance(event, (RoomMessageText, RoomMessageNotice)):
+        await matrix_utils.process_room_message(room, event)
+    elif isinstance(event, UnknownEvent):
+        await matrix_utils.process_room_reaction(room, event)
+
+async def replay(path, speed, only=None):
+    # Replayed traffic must never be written back into the capture being read
+    capture_utils.capture_enabled = False
+
+    loop = asyncio.get_running_loop()
+    meshtastic_utils.meshtastic_event_loop = loop
+    matrix_utils.matrix_event_loop = loop
+    meshtastic_utils.meshtastic_interface = StandInMeshtasticInterface()
+    matrix_utils.matrix_client = StandInMatrixClient()
+    # Captured events are older than this process; don't filter them out
+    matrix_utils.bot_start_time = 0
+
+    pub.subscribe(matrix_utils.handle_meshtastic_relay, "meshtastic.send_to_matrix")
+    pub.subscribe(meshtastic_utils.send_to_meshtastic_from_matrix, "matrix.send_to_meshtastic")
+
+    initialize_database()
+
+    replayed = 0
+    first_capture_time = None
+    start = time.perf_counter()
+    for record in read_capture(path):
+        if only and record["source"] != only:
+            continue
+        if first_capture_time is None:
+            first_capture_time = record["t"]
+        if speed > 0:
+            delay = (record["t"] - first_capture_time) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await dispatch(record, matrix_utils.matrix_client.user_id)
+        replayed += 1
+
+    # Let relays scheduled onto the loop finish before measuring
+    while matrix_utils.pending_relays:
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    logger.info(
+        f"Replayed {replayed} records in {elapsed:.3f}s "
+        f"({replayed / elapsed if elapsed else 0:.1f}/s): "
+        f"{meshtastic_utils.meshtastic_interface.sent} radio sends, "
+        f"{matrix_utils.matrix_client.sent} Matrix sends"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured relay traffic against stand-in interfaces.")
+    parser.add_argument("capture", help="Capture file written with capture.enabled")
+    parser.add_argument("--speed", type=float, default=1.0, help="Playback speed multiplier; 0 replays as fast as possible")
+    parser.add_argument("--only", choices=["meshtastic", "matrix"], help="Replay only one direction")
+    args = parser.parse_args()
+    asyncio.run(replay(args.capture, args.speed, args.only))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import asyncio
+import math
+import os
+import socket
+import sqlite3
+import time
+
+from config import relay_config
+from config_schema import worker_resources
+from log_utils import get_logger
+
+shard_logger = get_logger("Sharding")
+
+sharding_config = relay_config["sharding"]
+sharding_enabled = sharding_config["enabled"]
+lease_db = sharding_config["lease_db"]
+lease_seconds = sharding_config["lease_seconds"]
+worker_id = sharding_config.get("worker_id") or f"{socket.gethostname()}-{os.getpid()}"
+
+# Partitions (configured room IDs) this worker currently holds a lease on
+owned_partitions = set()
+
+# Exit code of a worker that refused to start because of a ResourceConflict
+RESOURCE_CONFLICT_EXIT = 3
+
+class ResourceConflict(RuntimeError):
+    """
+    Another live worker holds this worker's radio or one of its listening sockets.
+    """
+
+def get_partitions():
+    return [room["id"] for room in relay_config["matrix_rooms"]]
+
+def owns_room(room_id_or_alias):
+    """
+    Check whether this worker should relay for the given configured room.
+    Always true when sharding is disabled.
+    """
+    return not sharding_enabled or room_id_or_alias in owned_partitions
+
+def initialize_lease_database():
+    with sqlite3.connect(lease_db) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS shard_workers (worker_id TEXT PRIMARY KEY, last_seen REAL)")
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS shard_leases (partition TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS shard_resources (resource TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+        cursor.executemany(
+            "INSERT OR IGNORE INTO shard_leases (partition, owner, expires_at) VALUES (?, NULL, 0)",
+            [(partition,) for partition in get_partitions()],
+        )
+        conn.commit()
+
+def refresh_leases():
+    """
+    Heartbeat, renew our leases, and take or give back partitions so that each
+    live worker holds about an equal share. Runs in one write transaction so
+    two workers can never claim the same partition.
+    """
+    global owned_partitions
+    now = time.time()
+    expires_at = now + lease_seconds
+    partitions = get_partitions()
+
+    conn = sqlite3.connect(lease_db, timeout=lease_seconds, isolation_level=None)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute(
+            "INSERT OR REPLACE INTO shard_workers (worker_id, last_seen) VALUES (?, ?)", (worker_id, now))
+        cursor.execute(
+            "SELECT COUNT(*) FROM shard_workers WHERE last_seen >= ?", (now - lease_seconds,))
+        live_workers = max(cursor.fetchone()[0], 1)
+
+        # Two processes on one serial port or radio API connection corrupt each other's traffic
+        resources = worker_resources(relay_config)
+        cursor.execute(
+            f"SELECT resource, owner FROM shard_resources WHERE resource IN ({', '.join('?' * len(resources))})"
+            " AND owner != ? AND expires_at >= ?",
+            (*resources, worker_id, now),
+        )
+        conflict = cursor.fetchone()
+        if conflict:
+            raise ResourceConflict(f"worker {conflict[1]} is already using {conflict[0]}")
+        cursor.executemany(
+            "INSERT OR REPLACE INTO shard_resources (resource, owner, expires_at) VALUES (?, ?, ?)",
+            [(resource, worker_id, expires_at) for resource in resources],
+        )
+        fair_share = math.ceil(len(partitions) / live_workers)
+
+        cursor.execute("SELECT partition, owner, expires_at FROM shard_leases")
+        leases = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        owned = [p for p in partitions if p in leases and leases[p][0] == worker_id and leases[p][1] >= now]
+        free = [p for p in partitions if p in leases and (leases[p][0] is None or leases[p][1] < now)]
+
+        # Give back anything above our share so newly started workers get some
+        for partition in owned[fair_share:]:
+            cursor.execute(
+                "UPDATE shard_leases SET owner=NULL, expires_at=0 WHERE partition=?", (partition,))
+        owned = owned[:fair_share]
+        owned.extend(free[:fair_share - len(owned)])
+
+        cursor.executemany(
+            "UPDATE shard_leases SET owner=?, expires_at=? WHERE partition=?",
+            [(worker_id, expires_at, partition) for partition in owned],
+        )
+        cursor.execute("COMMIT")
+    except Exception:
+        # BEGIN IMMEDIATE itself can fail on a busy database; don't mask that error
+        if conn.in_transaction:
+            cursor.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+    owned = set(owned)
+    if owned != owned_partitions:
+        shard_logger.info(f"Worker {worker_id} now owns {len(owned)}/{len(partitions)} rooms: {sorted(owned)}")
+    owned_partitions = owned
+
+def release_leases():
+    global owned_partitions
+    with sqlite3.connect(lease_db, timeout=lease_seconds) as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE shard_leases SET owner=NULL, expires_at=0 WHERE owner=?", (worker_id,))
+        cursor.execute("DELETE FROM shard_resources WHERE owner=?", (worker_id,))
+        cursor.execute("DELETE FROM shard_workers WHERE worker_id=?", (worker_id,))
+        conn.commit()
+    owned_partitions = set()
+
+async def run_lease_loop():
+    """
+    Renew leases well before they expire. If renewal fails, stop relaying
+    rather than risk relaying alongside another worker.
+    """
+    global owned_partitions
+    try:
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            try:
+                # Off the event loop: waiting on a locked lease database must not stall relaying
+                await asyncio.get_running_loop().run_in_executor(None, refresh_leases)
+            except Exception as e:
+                shard_logger.error(f"Failed to renew shard leases, pausing relaying: {e}")
+                owned_partitions = set()
+    except asyncio.CancelledError:
+        release_leases()
+        raise
+
+async def start_sharding():
+    if not sharding_enabled:
+        return None
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, initialize_lease_database)
+    await loop.run_in_executor(None, refresh_leases)
+    return asyncio.create_task(run_lease_loop())
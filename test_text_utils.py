@@ -0,0 +1,80 @@
+"""
+Property tests for radio packet truncation.
+
+    python -m pytest test_text_utils.py
+"""
+import random
+
+import pytest
+
+from text_utils import MAX_MESSAGE_BYTES, build_message, truncate_utf8
+
+PREFIX = "Alice[M]: "
+
+# Whole grapheme clusters the truncation must never split: combining marks, skin tones,
+# flags, ZWJ sequences, variation selectors and tag sequences
+CLUSTERS = [
+    "a", " ", "\u00e9", "e\u0301", "\u4e2d", "\u0e01\u0e47", "\U0001f600", "\U0001f44d\U0001f3fd",
+    "\U0001f1f3\U0001f1ff", "\U0001f1fa\U0001f1f8", "\U0001f469\u200d\U0001f4bb",
+    "\U0001f468\u200d\U0001f469\u200d\U0001f467", "\u2764\ufe0f",
+    "\U0001f3f4\U000e0067\U000e0062\U000e0073\U000e0063\U000e0074\U000e007f",
+]
+
+BUDGETS = range(0, MAX_MESSAGE_BYTES + 8)
+
+def naive_truncate(text, max_bytes):
+    return text.encode("utf-8")[:max_bytes].decode("utf-8", "ignore")
+
+def random_clusters(seed, max_clusters=120):
+    rng = random.Random(seed)
+    return [rng.choice(CLUSTERS) for _ in range(rng.randint(0, max_clusters))]
+
+def cluster_boundaries(clusters):
+    boundaries = [0]
+    for cluster in clusters:
+        boundaries.append(boundaries[-1] + len(cluster))
+    return boundaries
+
+@pytest.mark.parametrize("seed", range(50))
+def test_truncate_matches_naive_cut(seed):
+    text = "".join(random_clusters(seed))
+    for max_bytes in BUDGETS:
+        assert truncate_utf8(text, max_bytes) == naive_truncate(text, max_bytes)
+
+@pytest.mark.parametrize("text", ["lorem ipsum dolor sit amet " * 2400, "\U0001f44d\U0001f3fd\u4e2d\u00e9" * 5000])
+def test_truncate_long_input(text):
+    for max_bytes in BUDGETS:
+        assert truncate_utf8(text, max_bytes) == naive_truncate(text, max_bytes)
+
+@pytest.mark.parametrize("seed", range(50))
+@pytest.mark.parametrize("graphemes", [False, True])
+def test_build_message_fits_budget(seed, graphemes):
+    text = "".join(random_clusters(seed))
+    for max_bytes in BUDGETS:
+        message = build_message(PREFIX, text, max_bytes, graphemes)
+        assert len(message.encode("utf-8")) <= max_bytes
+        if max_bytes >= len(PREFIX):
+            assert message.startswith(PREFIX)
+
+@pytest.mark.parametrize("seed", range(200))
+def test_grapheme_cut_lands_on_cluster_boundary(seed):
+    clusters = random_clusters(seed)
+    text = "".join(clusters)
+    boundaries = cluster_boundaries(clusters)
+    for max_bytes in BUDGETS:
+        cut = truncate_utf8(text, max_bytes, graphemes=True)
+        assert text.startswith(cut)
+        assert len(cut.encode("utf-8")) <= max_bytes
+        assert len(cut) in boundaries, f"split a cluster at {max_bytes} bytes: {text!r} -> {cut!r}"
+
+@pytest.mark.parametrize("seed", range(200))
+def test_grapheme_cut_keeps_every_cluster_that_fits(seed):
+    clusters = random_clusters(seed)
+    text = "".join(clusters)
+    boundaries = cluster_boundaries(clusters)
+    for max_bytes in BUDGETS:
+        cut = truncate_utf8(text, max_bytes, graphemes=True)
+        kept = boundaries.index(len(cut))
+        if kept < len(clusters):
+            with_next = text[:boundaries[kept + 1]]
+            assert len(with_next.encode("utf-8")) > max_bytes, f"cut too short at {max_bytes} bytes: {cut!r}"
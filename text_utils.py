@@ -0,0 +1,80 @@
+import unicodedata
+
+# Largest text payload a Meshtastic packet carries
+MAX_MESSAGE_BYTES = 227
+
+ZWJ = "\u200d"  # Zero width joiner
+
+def _is_grapheme_extend(char):
+    """
+    Approximate the Unicode grapheme Extend/SpacingMark classes: combining
+    marks, variation selectors, emoji skin tones and tag characters.
+    """
+    code = ord(char)
+    return (
+        unicodedata.category(char) in ("Mn", "Me", "Mc")
+        or 0xFE00 <= code <= 0xFE0F
+        or 0x1F3FB <= code <= 0x1F3FF
+        or 0xE0020 <= code <= 0xE007F
+        or 0xE0100 <= code <= 0xE01EF
+        or char == ZWJ
+    )
+
+def _is_regional_indicator(char):
+    return 0x1F1E6 <= ord(char) <= 0x1F1FF
+
+def _grapheme_boundary(text, index):
+    """
+    Move a cut point at `index` back until it no longer splits a grapheme cluster.
+    """
+    while index > 0 and (_is_grapheme_extend(text[index]) or text[index - 1] == ZWJ):
+        index -= 1
+    if index > 0 and _is_regional_indicator(text[index]):
+        # Flags are pairs of regional indicators; don't cut between the two halves
+        run = 0
+        while index - run > 0 and _is_regional_indicator(text[index - run - 1]):
+            run += 1
+        if run % 2:
+            index -= 1
+    return index
+
+def truncate_utf8(text, max_bytes=MAX_MESSAGE_BYTES, graphemes=False):
+    """
+    Cut text to at most max_bytes of UTF-8 without splitting a character, or
+    a grapheme cluster when `graphemes` is set. Only the first max_bytes
+    characters are ever encoded, however long the input is.
+    """
+    if max_bytes <= 0:
+        return ""
+    # Even four bytes per character would fit
+    if len(text) * 4 <= max_bytes:
+        return text
+
+    head = text[:max_bytes]
+    if head.isascii():
+        cut = len(head)
+    else:
+        encoded = head.encode("utf-8")
+        if len(encoded) <= max_bytes:
+            cut = len(head)
+        else:
+            end = max_bytes
+            # Step back over continuation bytes to the start of the split character
+            while (encoded[end] & 0xC0) == 0x80:
+                end -= 1
+            cut = len(encoded[:end].decode("utf-8"))
+
+    if cut >= len(text):
+        return text
+    if graphemes:
+        cut = _grapheme_boundary(text, cut)
+    return text[:cut]
+
+def build_message(prefix, text, max_bytes=MAX_MESSAGE_BYTES, graphemes=False):
+    """
+    Join prefix and text so the whole packet fits in max_bytes. The prefix is
+    kept whole when it fits and the text gets whatever budget remains.
+    """
+    prefix = truncate_utf8(prefix, max_bytes, graphemes)
+    budget = max_bytes - len(prefix.encode("utf-8"))
+    return prefix + truncate_utf8(text, budget, graphemes)
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import logging.handlers
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from config import relay_config
+from log_utils import get_logger
+
+trace_logger = get_logger("Tracing")
+
+tracing_config = relay_config["tracing"]
+tracing_enabled = tracing_config["enabled"]
+sample_rate = float(tracing_config["sample_rate"])
+otlp_endpoint = tracing_config.get("otlp_endpoint")
+export_interval = tracing_config.get("export_interval", 5)
+export_batch_size = tracing_config.get("export_batch_size", 256)
+
+# Finished traces waiting for the OTLP exporter
+pending_exports = []
+_file_writer = None
+
+class Trace:
+    """
+    Span timings for one relayed message, from the moment it is received
+    until the last destination has been sent to.
+    """
+
+    __slots__ = ("trace_id", "span_id", "name", "start_ns", "end_ns", "spans", "attributes", "error", "_pending")
+
+    def __init__(self, name, **attributes):
+        self.trace_id = os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.spans = []
+        self.attributes = attributes
+        self.error = None
+        self._pending = 1
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": (self.end_ns - self.start_ns) / 1e6,
+            "attributes": self.attributes,
+            "error": self.error,
+            "spans": [
+                {
+                    "name": name,
+                    "offset_ms": (start_ns - self.start_ns) / 1e6,
+                    "duration_ms": (end_ns - start_ns) / 1e6,
+                    "attributes": attributes,
+                }
+                for name, start_ns, end_ns, attributes in self.spans
+            ],
+        }
+
+def start_trace(name, **attributes):
+    """
+    Start a trace for a message, or return None when it isn't sampled.
+    Every other helper in this module accepts None and does nothing with it.
+    """
+    if not tracing_enabled or random.random() >= sample_rate:
+        return None
+    return Trace(name, **attributes)
+
+@contextmanager
+def span(trace, name, **attributes):
+    if trace is None:
+        yield
+        return
+    start_ns = time.time_ns()
+    try:
+        yield
+    finally:
+        trace.spans.append((name, start_ns, time.time_ns(), attributes))
+
+def add_span(trace, name, start_ns, end_ns=None, **attributes):
+    if trace is not None:
+        trace.spans.append((name, start_ns, end_ns or time.time_ns(), attributes))
+
+def set_attributes(trace, **attributes):
+    if trace is not None:
+        trace.attributes.update(attributes)
+
+def hold_trace(trace, count=1):
+    """
+    Keep a trace open until `count` more calls to finish_trace, one per fan-out destination.
+    """
+    if trace is not None:
+        trace._pending += count
+
+def finish_trace(trace, error=None):
+    if trace is None:
+        return
+    if error:
+        trace.error = str(error)
+    trace._pending -= 1
+    if trace._pending > 0:
+        return
+    trace.end_ns = time.time_ns()
+    export_trace(trace)
+
+def get_file_writer():
+    global _file_writer
+    if _file_writer is None:
+        _file_writer = logging.getLogger("m2m-lite.traces")
+        _file_writer.setLevel(logging.INFO)
+        _file_writer.propagate = False
+        handler = logging.handlers.RotatingFileHandler(
+            tracing_config["file"],
+            maxBytes=tracing_config.get("max_bytes", 5 * 1024 * 1024),
+            backupCount=tracing_config.get("backup_count", 3),
+        )
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        _file_writer.addHandler(handler)
+    return _file_writer
+
+def export_trace(trace):
+    if otlp_endpoint:
+        pending_exports.append(trace)
+        # Don't let an unreachable collector grow the buffer without bound
+        if len(pending_exports) > export_batch_size * 10:
+            del pending_exports[:export_batch_size]
+    else:
+        get_file_writer().info(json.dumps(trace.to_dict(), ensure_ascii=False))
+
+def _otlp_attributes(attributes):
+    return [{"key": key, "value": {"stringValue": str(value)}} for key, value in attributes.items()]
+
+def to_otlp(traces):
+    """
+    Convert finished traces into an OTLP/HTTP JSON export request.
+    """
+    spans = []
+    for trace in traces:
+        status = {"code": 2, "message": trace.error} if trace.error else {"code": 1}
+        spans.append(
+            {
+                "traceId": trace.trace_id,
+                "spanId": trace.span_id,
+                "name": trace.name,
+                "kind": 1,
+                "startTimeUnixNano": str(trace.start_ns),
+                "endTimeUnixNano": str(trace.end_ns),
+                "attributes": _otlp_attributes(trace.attributes),
+                "status": status,
+            }
+        )
+        for name, start_ns, end_ns, attributes in trace.spans:
+            spans.append(
+                {
+                    "traceId": trace.trace_id,
+                    "spanId": os.urandom(8).hex(),
+                    "parentSpanId": trace.span_id,
+                    "name": name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(start_ns),
+                    "endTimeUnixNano": str(end_ns),
+                    "attributes": _otlp_attributes(attributes),
+                }
+            )
+    return {
+        "resourceSpans": [
+            {
+                "resource": {"attributes": _otlp_attributes({"service.name": "m2m-lite"})},
+                "scopeSpans": [{"scope": {"name": "m2m-lite"}, "spans": spans}],
+            }
+        ]
+    }
+
+async def run_otlp_exporter():
+    """
+    Periodically push batched traces to the configured OTLP collector.
+    """
+    import aiohttp
+
+    url = otlp_endpoint.rstrip("/") + "/v1/traces"
+    async with aiohttp.ClientSession() as session:
+        while True:
+            await asyncio.sleep(export_interval)
+            while pending_exports:
+                batch = pending_exports[:export_batch_size]
+                del pending_exports[:export_batch_size]
+                try:
+                    async with session.post(url, json=to_otlp(batch), timeout=aiohttp.ClientTimeout(total=10)) as response:
+                        if response.status >= 400:
+                            trace_logger.warning(f"OTLP collector rejected {len(batch)} traces: HTTP {response.status}")
+                except Exception as e:
+                    trace_logger.warning(f"Failed to export {len(batch)} traces: {e}")
+                    break
+
+def start_trace_exporter():
+    """
+    Start the background OTLP exporter if one is configured.
+    """
+    if tracing_enabled and otlp_endpoint:
+        trace_logger.info(f"Exporting traces to {otlp_endpoint} (sample rate {sample_rate})")
+        return asyncio.create_task(run_otlp_exporter())
+    if tracing_enabled:
+        trace_logger.info(f"Writing traces to {tracing_config['file']} (sample rate {sample_rate})")
+    return None